@@ -0,0 +1,295 @@
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+from itertools import chain
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import metrics
+import security
+import service
+import sessions
+from security import HashingBusy
+
+log = logging.getLogger(__name__)
+
+# ------------------ Configuration ------------------
+# Run with: python api.py --port 8600
+# Every call goes through service.py, the same layer the Streamlit pages use.
+MAX_BODY = 1 << 20
+MAX_PAGE = 100
+# GET /metrics needs "Authorization: Bearer $VAULT_METRICS_TOKEN" when that is
+# set, and is limited to loopback clients when it is not.
+METRICS_TOKEN = os.environ.get("VAULT_METRICS_TOKEN", "")
+
+STATUS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized",
+          404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+          422: "Unprocessable Entity", 429: "Too Many Requests",
+          500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ------------------ API Tokens ------------------
+# Login hands out a bearer token so scrypt runs once per client, not per call.
+# Tokens are sessions from sessions.py, so any API worker can serve them.
+def _bearer(headers):
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    return token if scheme.lower() == "bearer" else None
+
+
+def token_user(headers):
+    token = _bearer(headers)
+    username = sessions.get_sessions().get(token) if token else None
+    if not username:
+        raise HttpError(401, "Missing or expired token.")
+    return username
+
+
+# ------------------ Routes ------------------
+def _page(query):
+    try:
+        offset = int(query.get("offset", ["0"])[0])
+        limit = min(int(query.get("limit", ["20"])[0]), MAX_PAGE)
+    except ValueError:
+        raise HttpError(400, "'offset' and 'limit' must be integers.")
+    return max(offset, 0), max(limit, 1)
+
+
+def _field(body, name):
+    value = body.get(name)
+    if not isinstance(value, str) or not value:
+        raise HttpError(400, f"'{name}' is required.")
+    return value
+
+
+def _compression(body):
+    # Opt-in per request: text is only compressed when the client asks.
+    compression = body.get("compression") or "none"
+    if compression not in ("zlib", "lzma", "none"):
+        raise HttpError(400, "'compression' must be zlib, lzma or none.")
+    return compression
+
+
+async def route(method, path, query, headers, body, ip):
+    # Returns (status, payload); payload is a dict for JSON, a str for plain
+    # text, or an iterator of byte chunks for a streamed file.
+    run = asyncio.to_thread
+    parts = [unquote(p) for p in path.strip("/").split("/")]
+
+    if parts == ["register"] and method == "POST":
+        await run(service.register, _field(body, "username"), _field(body, "email"),
+                  _field(body, "password"), ip)
+        return 201, {"registered": body["username"]}
+
+    if parts == ["login"] and method == "POST":
+        username = await run(service.login, _field(body, "email"), _field(body, "password"), ip)
+        if not username:
+            raise HttpError(401, "Invalid email or password.")
+        token = await run(sessions.get_sessions().create, username)
+        return 200, {"username": username, "token": token}
+
+    if parts == ["logout"] and method == "POST":
+        token = _bearer(headers)
+        if token:
+            await run(sessions.get_sessions().delete, token)
+        return 200, {"logged_out": True}
+
+    if parts == ["rotate"] and method == "POST":
+        username = await run(token_user, headers)
+        await run(service.rotate_key, username)
+        return 200, {"rotation": await run(service.rotation_progress, username)}
+
+    if parts == ["metrics"] and method == "GET":
+        if METRICS_TOKEN:
+            given = headers.get("authorization", "").partition(" ")[2]
+            if not hmac.compare_digest(given.encode(), METRICS_TOKEN.encode()):
+                raise HttpError(401, "Missing or invalid metrics token.")
+        elif ip not in ("127.0.0.1", "::1"):
+            raise HttpError(401, "Metrics are only served to local clients.")
+        return 200, metrics.render()
+
+    if parts == ["users"] and method == "GET":
+        prefix = query.get("prefix", [""])[0]
+        offset, limit = _page(query)
+        total = await run(service.count_users, prefix)
+        users = await run(service.list_users, prefix, offset, limit)
+        return 200, {"total": total, "users": [data.get("email") or username
+                                               for username, data in users]}
+
+    if parts[0] == "entries":
+        username = await run(token_user, headers)
+        if len(parts) == 1 and method == "GET" and query.get("q"):
+            found = await run(service.search, username, query["q"][0])
+            return 200, {"total": len(found), "entries": found}
+        if len(parts) == 1 and method == "GET":
+            offset, limit = _page(query)
+            total = await run(service.count_entries, username)
+            return 200, {"total": total,
+                         "entries": await run(service.list_entries, username, offset, limit)}
+        if len(parts) == 1 and method == "POST":
+            tags = body.get("tags", [])
+            if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+                raise HttpError(400, "'tags' must be a list of strings.")
+            entry_id, _ = await run(service.store_text, username, body.get("title", ""),
+                                    _field(body, "text"), _compression(body), tags)
+            return 201, {"id": entry_id}
+        if len(parts) == 1 and method == "DELETE":
+            await run(service.delete_all, username)
+            return 200, {"deleted": True}
+        if len(parts) == 2 and method == "GET":
+            entry = await run(service.reveal, username, parts[1])
+            if not entry:
+                raise HttpError(404, "No such entry.")
+            if "chunks" in entry:
+                # Decrypt the first chunk before any headers go out, so a
+                # missing or tampered blob still gets an error status.
+                first = await asyncio.to_thread(next, entry["chunks"], b"")
+                return 200, chain([first], entry["chunks"])
+            return 200, entry
+        if len(parts) == 2 and method == "DELETE":
+            if not await run(service.delete_entry, username, parts[1]):
+                raise HttpError(404, "No such entry.")
+            return 200, {"deleted": parts[1]}
+        if len(parts) == 2 and method == "PUT":
+            version = await run(service.update_text, username, parts[1], _field(body, "text"),
+                                _compression(body))
+            return 200, {"id": parts[1], "version": version}
+        if len(parts) == 3 and parts[2] == "versions" and method == "GET":
+            versions = await run(service.entry_versions, username, parts[1])
+            if not versions:
+                raise HttpError(404, "No such entry.")
+            return 200, {"versions": versions}
+        if len(parts) == 4 and parts[2] == "versions" and method == "GET":
+            if not parts[3].isdigit():
+                raise HttpError(404, "No such version.")
+            text = await run(service.reveal_version, username, parts[1], int(parts[3]))
+            if text is None:
+                raise HttpError(404, "No such version.")
+            return 200, {"id": parts[1], "version": int(parts[3]), "text": text}
+        raise HttpError(405, "Method not allowed.")
+
+    raise HttpError(404, "Not found.")
+
+
+# ------------------ HTTP/1.1 Server ------------------
+def _head(status, headers):
+    lines = [f"HTTP/1.1 {status} {STATUS.get(status, 'Unknown')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _respond(writer, status, payload, keep_alive):
+    connection = "keep-alive" if keep_alive else "close"
+    if isinstance(payload, dict):
+        body = json.dumps(payload).encode()
+        writer.write(_head(status, {"Content-Type": "application/json",
+                                    "Content-Length": len(body),
+                                    "Connection": connection}) + body)
+        await writer.drain()
+        return
+    if isinstance(payload, str):
+        body = payload.encode()
+        writer.write(_head(status, {"Content-Type": "text/plain; version=0.0.4",
+                                    "Content-Length": len(body),
+                                    "Connection": connection}) + body)
+        await writer.drain()
+        return
+    # File entries stream back chunk by chunk; decryption runs off the loop.
+    writer.write(_head(status, {"Content-Type": "application/octet-stream",
+                                "Transfer-Encoding": "chunked",
+                                "Connection": connection}))
+    while True:
+        try:
+            chunk = await asyncio.to_thread(next, payload, None)
+        except (security.InvalidToken, OSError):
+            # Too late for an error status: drop the connection before the
+            # final chunk, so the client sees a truncated body, not a whole one.
+            log.exception("File download failed mid-stream")
+            raise ConnectionAbortedError
+        if chunk is None:
+            break
+        if chunk:
+            writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def serve_connection(reader, writer):
+    ip = (writer.get_extra_info("peername") or (None,))[0]
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                break
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ", 2)
+            except ValueError:
+                break
+            headers = {}
+            for line in lines[1:]:
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+            keep_alive = (version == "HTTP/1.1"
+                          and headers.get("connection", "").lower() != "close")
+            length = headers.get("content-length") or "0"
+            if not length.isdigit():
+                break
+            length = int(length)
+            if length > MAX_BODY:
+                await _respond(writer, 413, {"error": "Request body too large."}, False)
+                break
+            raw = await reader.readexactly(length) if length else b""
+
+            url = urlsplit(target)
+            try:
+                body = json.loads(raw) if raw else {}
+                if not isinstance(body, dict):
+                    raise HttpError(400, "Expected a JSON object.")
+                status, payload = await route(method, url.path, parse_qs(url.query),
+                                              headers, body, ip)
+            except HttpError as e:
+                status, payload = e.status, {"error": str(e)}
+            except json.JSONDecodeError:
+                status, payload = 400, {"error": "Invalid JSON."}
+            except ValueError as e:
+                status, payload = 400, {"error": str(e)}
+            except HashingBusy as e:
+                status, payload = 429, {"error": str(e)}
+            except (security.InvalidToken, FileNotFoundError):
+                status, payload = 422, {"error": "Unable to decrypt. Data might be corrupted."}
+            except Exception:
+                status, payload = 500, {"error": "Internal server error."}
+            await _respond(writer, status, payload, keep_alive)
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def main(host, port):
+    service.start_background_jobs()
+    server = await asyncio.start_server(serve_connection, host, port)
+    print(f"Secure Vault API listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Secure Vault HTTP/JSON API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port))
@@ -0,0 +1,713 @@
+import json
+import os
+import queue
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+import storage
+from storage import HISTORY_FILE, SEARCH_FILE, USERS_FILE, VAULT_FILE, normalize_email
+
+# ------------------ Configuration ------------------
+# VAULT_BACKEND picks the store: "json" (users.json + vault log, the default)
+# or "sqlite" (a single database file at VAULT_DB).
+BACKEND = os.environ.get("VAULT_BACKEND", "json")
+DB_FILE = os.environ.get("VAULT_DB", "vault.db")
+POOL_SIZE = int(os.environ.get("VAULT_DB_POOL", "8"))
+
+# Title given to the single secret users stored before entries had names.
+LEGACY_TITLE = "Saved secret"
+# Entry fields update_tokens may re-encrypt.
+TOKEN_FIELDS = ("token", "tags")
+
+
+class KeyRotated(Exception):
+    # Raised by writes given the key their tokens were encrypted with
+    # (key=...) when the user's key has changed since. Key changes and these
+    # writes are serialized, so a token on a replaced key never lands after a
+    # rotation has started; the caller re-encrypts and tries again.
+    pass
+
+
+def _metadata(entry_id, entry):
+    return {"id": entry_id, "title": entry["title"], "created": entry["created"],
+            "version": entry.get("version", 1)}
+
+
+def _stored(entry):
+    # An entry without any older versions kept inline (see JsonBackend).
+    return {key: value for key, value in entry.items() if key != "history"}
+
+
+def _current(entry_id, entry):
+    # An entry without its older versions, which only the history methods return.
+    current = _stored(entry)
+    current["id"] = entry_id
+    return current
+
+
+def _terms_key(username):
+    return "u:" + username
+
+
+def _posting_key(username, token):
+    return f"t:{token}:{username}"
+
+
+def _history_key(username, entry_id):
+    return f"h:{username}:{entry_id}"
+
+
+def _pruned(history, keep=None, before=None):
+    # Drops the oldest versions: those created before `before` (versions of
+    # unknown age count as old), then all but the newest `keep`.
+    if before is not None:
+        history = [item for item in history if (item["created"] or 0) >= before]
+    if keep is not None:
+        history = history[max(len(history) - keep, 0):] if keep else []
+    return history
+
+
+# ------------------ JSON Backend ------------------
+class JsonBackend:
+    def get_user(self, username):
+        return storage.load_file(USERS_FILE).get(username)
+
+    def find_user_by_email(self, email):
+        return storage.find_user_by_email(email)
+
+    def add_user(self, username, record):
+        storage.add_user(username, record)
+
+    def update_user(self, username, changes, expected=None):
+        if "key" not in changes:
+            return storage.update_user(username, changes, expected)
+        # Writes check the key under the vault lock (see KeyRotated).
+        with storage.locked(VAULT_FILE):
+            return storage.update_user(username, changes, expected)
+
+    def _check_key(self, username, key):
+        # Call with the vault locked.
+        if key is not None and (self.get_user(username) or {}).get("key") != key:
+            raise KeyRotated(username)
+
+    def count_users(self, prefix=""):
+        return storage.count_users(prefix)
+
+    def list_users(self, prefix="", offset=0, limit=20):
+        return storage.list_users(prefix, offset, limit)
+
+    # Each user's vault value is a dict of entry id -> {title, created, token}
+    # in insertion order; older vaults hold a single bare token string. Edited
+    # entries also have "version" and "updated". Their older versions are kept
+    # apart, in a history record per entry whose fields are the versions, so
+    # reading or writing the current entries never touches them and an edit
+    # appends just the new version. Entries last edited before that may still
+    # hold theirs inline in "history"; the next write to them moves it out.
+    def _entries(self, username):
+        value = storage.get_record(VAULT_FILE, username) or {}
+        if isinstance(value, str):
+            return {"legacy": {"title": LEGACY_TITLE, "created": None, "token": value}}
+        return value
+
+    def add_entry(self, username, title, token, tags=None, terms=(), key=None):
+        return self.add_entries(username, [(title, token, tags, terms)], key)[0]
+
+    def _upgrade_legacy(self, username):
+        # Call with the vault locked: turns a bare token into a collection.
+        if isinstance(storage.get_record(VAULT_FILE, username), str):
+            storage.put_record(VAULT_FILE, username, self._entries(username))
+
+    def add_entries(self, username, items, key=None):
+        # items: (title, token, encrypted tags or None, blind tokens) tuples,
+        # written as one log append, then indexed.
+        now, entries, terms = time.time(), {}, {}
+        for title, token, tags, entry_terms in items:
+            entry_id = secrets.token_hex(8)
+            entries[entry_id] = {"title": title, "created": now, "token": token}
+            if tags:
+                entries[entry_id]["tags"] = tags
+            terms[entry_id] = entry_terms
+        with storage.locked(VAULT_FILE):
+            self._check_key(username, key)
+            self._upgrade_legacy(username)
+            storage.put_fields(VAULT_FILE, username, entries)
+        self.index_entries(username, terms)
+        return list(entries)
+
+    def update_tokens(self, username, changes, field="token"):
+        # changes: entry id -> (expected token, new token) for one of the
+        # TOKEN_FIELDS. Entries deleted or rewritten meanwhile are left alone.
+        with storage.locked(VAULT_FILE):
+            self._upgrade_legacy(username)
+            entries = self._entries(username)
+            fields = {entry_id: dict(entries[entry_id], **{field: new})
+                      for entry_id, (old, new) in changes.items()
+                      if entry_id in entries and entries[entry_id].get(field) == old}
+            if fields:
+                storage.put_fields(VAULT_FILE, username, fields)
+
+    # The search index has a record per user and blind token whose fields
+    # are the ids of the entries listed under it, so indexing an entry
+    # appends a few small fields however long the lists grow, and a record
+    # per user whose fields are their tokens, for delete_entries. Emptied
+    # lists stay until then, so they are bounded by the user's vocabulary.
+    # Lists can hold ids of entries deleted without being unindexed;
+    # find_entries only returns entries still in the vault.
+    def index_entries(self, username, terms):
+        # terms: entry id -> blind tokens to list it under.
+        known = storage.get_record(SEARCH_FILE, _terms_key(username)) or {}
+        changes, new = [], {}
+        for entry_id, tokens in terms.items():
+            for token in tokens:
+                changes.append((_posting_key(username, token), entry_id, 1))
+                if token not in known:
+                    new[token] = 1
+        changes += [(_terms_key(username), token, 1) for token in new]
+        if changes:
+            storage.update_records(SEARCH_FILE, changes)
+
+    def find_entries(self, username, terms, limit=50):
+        # Newest first, the entries listed under every one of the terms.
+        lists = sorted((storage.get_record(SEARCH_FILE, _posting_key(username, token)) or {}
+                        for token in set(terms)), key=len)
+        if not lists or not lists[0]:
+            return []
+        ids = set(lists[0]).intersection(*lists[1:])
+        entries = self._entries(username)
+        found = sorted((entry_id for entry_id in ids if entry_id in entries),
+                       key=lambda entry_id: entries[entry_id]["created"] or 0, reverse=True)
+        return [_metadata(entry_id, entries[entry_id]) for entry_id in found[:limit]]
+
+    def iter_entries(self, username, after=None):
+        # Oldest first, tokens included. Entry dicts are replaced on write,
+        # so iterating this snapshot is safe while others add entries. Ids
+        # carry no order here, so resuming after an entry that has since been
+        # deleted starts over from the beginning.
+        entries = self._entries(username)
+        start = list(entries).index(after) + 1 if after in entries else 0
+        for entry_id, entry in islice(entries.items(), start, None):
+            yield _current(entry_id, entry)
+
+    def count_entries(self, username):
+        return len(self._entries(username))
+
+    def list_entries(self, username, offset=0, limit=10):
+        # Newest first, walking only as far as the requested page.
+        entries = self._entries(username)
+        page = islice(reversed(entries.items()), offset, offset + limit)
+        return [_metadata(entry_id, entry) for entry_id, entry in page]
+
+    def get_entry(self, username, entry_id):
+        entry = self._entries(username).get(entry_id)
+        return _current(entry_id, entry) if entry else None
+
+    def _history(self, username, entry_id, entry):
+        # Older versions, oldest first, wherever they are kept.
+        items = {item["version"]: item for item in entry.get("history", [])}
+        stored = storage.get_record(HISTORY_FILE, _history_key(username, entry_id)) or {}
+        items.update((item["version"], item) for item in stored.values())
+        return [items[version] for version in sorted(items)]
+
+    def _save_history(self, username, entry_id, entry, old, new):
+        # Call with the vault locked. Writes the change from the versions in
+        # old to those in new. Versions still inline in the entry are written
+        # in full; the caller then stores the entry without them.
+        history_key, inline = _history_key(username, entry_id), "history" in entry
+        kept = {item["version"] for item in new}
+        changes = [(history_key, str(item["version"]), item)
+                   for item in new if inline or item not in old]
+        changes += [(history_key, str(item["version"]), None)
+                    for item in old if item["version"] not in kept]
+        if changes:
+            storage.update_records(HISTORY_FILE, changes)
+
+    def get_history(self, username, entry_id):
+        # (entry, older versions oldest first). Versions are written under the
+        # vault lock, so reading under it keeps the two consistent.
+        with storage.locked(VAULT_FILE):
+            entry = self._entries(username).get(entry_id)
+            if not entry:
+                return None, []
+            return _current(entry_id, entry), self._history(username, entry_id, entry)
+
+    def add_version(self, username, entry_id, expected, token, item, keep, before=None,
+                    key=None):
+        # Makes token the current version if the entry still holds expected,
+        # moving the replaced version into the history as item, then prunes.
+        with storage.locked(VAULT_FILE):
+            self._check_key(username, key)
+            self._upgrade_legacy(username)
+            entry = self._entries(username).get(entry_id)
+            if not entry or entry["token"] != expected:
+                return False
+            old = self._history(username, entry_id, entry)
+            self._save_history(username, entry_id, entry, old, _pruned([*old, item], keep, before))
+            storage.put_field(VAULT_FILE, username, entry_id, dict(
+                _stored(entry), token=token, version=item["version"] + 1, updated=time.time()))
+        return True
+
+    def update_version_tokens(self, username, entry_id, changes):
+        # changes: version -> (expected token, new token), as update_tokens.
+        with storage.locked(VAULT_FILE):
+            entry = self._entries(username).get(entry_id)
+            if not entry:
+                return
+            old = self._history(username, entry_id, entry)
+            new = [dict(item, token=changes[item["version"]][1])
+                   if changes.get(item["version"], (None,))[0] == item["token"] else item
+                   for item in old]
+            if new != old or "history" in entry:
+                self._save_history(username, entry_id, entry, old, new)
+            if "history" in entry:
+                storage.put_field(VAULT_FILE, username, entry_id, _stored(entry))
+
+    def prune_versions(self, username, before):
+        # Drops versions created before `before` from all of a user's entries;
+        # returns how many went. Only edited entries have older versions.
+        with storage.locked(VAULT_FILE):
+            moved, dropped = {}, 0
+            for entry_id, entry in self._entries(username).items():
+                if (entry.get("version") or 1) < 2:
+                    continue
+                history = self._history(username, entry_id, entry)
+                if history and (history[0]["created"] or 0) < before:
+                    kept = _pruned(history, before=before)
+                    self._save_history(username, entry_id, entry, history, kept)
+                    dropped += len(history) - len(kept)
+                    if "history" in entry:
+                        moved[entry_id] = _stored(entry)
+            if moved:
+                storage.put_fields(VAULT_FILE, username, moved)
+        return dropped
+
+    def delete_entry(self, username, entry_id, terms=()):
+        # terms: the blind tokens the entry was indexed under.
+        with storage.locked(VAULT_FILE):
+            # A bare token is the whole record; once upgraded, "legacy" is
+            # just one field next to the user's other entries.
+            if entry_id == "legacy" and isinstance(storage.get_record(VAULT_FILE, username), str):
+                storage.delete_record(VAULT_FILE, username)
+            else:
+                storage.delete_field(VAULT_FILE, username, entry_id)
+            storage.delete_record(HISTORY_FILE, _history_key(username, entry_id))
+        if terms:
+            storage.update_records(SEARCH_FILE, [(_posting_key(username, token), entry_id, None)
+                                                 for token in set(terms)])
+
+    def delete_entries(self, username):
+        with storage.locked(VAULT_FILE):
+            edited = [entry_id for entry_id, entry in self._entries(username).items()
+                      if (entry.get("version") or 1) > 1]
+            storage.delete_record(VAULT_FILE, username)
+            if edited:
+                storage.update_records(HISTORY_FILE, [(_history_key(username, entry_id), None, None)
+                                                      for entry_id in edited])
+        self.clear_index(username)
+
+    def clear_index(self, username):
+        # Drops all of the user's postings, as when their index key changes.
+        tokens = storage.get_record(SEARCH_FILE, _terms_key(username))
+        if tokens:
+            storage.update_records(SEARCH_FILE, [(_posting_key(username, token), None, None)
+                                                 for token in tokens]
+                                   + [(_terms_key(username), None, None)])
+
+
+# ------------------ SQLite Backend ------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    email TEXT,
+    record TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users(email) WHERE email IS NOT NULL;
+CREATE INDEX IF NOT EXISTS users_listing ON users(COALESCE(email, lower(username)), username);
+CREATE TABLE IF NOT EXISTS vault (
+    username TEXT PRIMARY KEY,
+    token TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created REAL,
+    token TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    updated REAL,
+    tags TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_user ON entries(username, id);
+CREATE TABLE IF NOT EXISTS entry_terms (
+    username TEXT NOT NULL,
+    term TEXT NOT NULL,
+    entry_id INTEGER NOT NULL,
+    PRIMARY KEY (username, term, entry_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entry_terms_entry ON entry_terms(entry_id);
+CREATE TABLE IF NOT EXISTS entry_versions (
+    entry_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    created REAL,
+    kind TEXT NOT NULL,
+    token TEXT NOT NULL,
+    PRIMARY KEY (entry_id, version)
+);
+"""
+# Columns added to entries after the first release, for older databases.
+ENTRY_COLUMNS = {"version": "INTEGER NOT NULL DEFAULT 1", "updated": "REAL", "tags": "TEXT"}
+
+
+class SqliteBackend:
+    def __init__(self, path=DB_FILE, pool_size=POOL_SIZE):
+        self.path = path
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(None)  # connections are opened on first use
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            for name, definition in ENTRY_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE entries ADD COLUMN {name} {definition}")
+        # Single-secret rows from the original vault table become entries.
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO entries (username, title, created, token) "
+                "SELECT username, ?, NULL, token FROM vault", (LEGACY_TITLE,))
+            conn.execute("DELETE FROM vault")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                               isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._pool.get()
+        try:
+            if conn is None:
+                conn = self._connect()
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def get_user(self, username):
+        with self.connection() as conn:
+            row = conn.execute("SELECT record FROM users WHERE username = ?",
+                               (username,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_user_by_email(self, email):
+        with self.connection() as conn:
+            row = conn.execute("SELECT username FROM users WHERE email = ?",
+                               (normalize_email(email),)).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, username, record):
+        email = normalize_email(record["email"])
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone():
+                raise ValueError("Username already exists.")
+            if conn.execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone():
+                raise ValueError("Email is already registered.")
+            conn.execute("INSERT INTO users (username, email, record) VALUES (?, ?, ?)",
+                         (username, email, json.dumps(record)))
+
+    def update_user(self, username, changes, expected=None):
+        if "email" in changes:
+            raise ValueError("Email cannot be changed with update_user.")
+        with self.transaction() as conn:
+            row = conn.execute("SELECT record FROM users WHERE username = ?",
+                               (username,)).fetchone()
+            if not row:
+                raise KeyError(username)
+            record = json.loads(row[0])
+            if expected and any(record.get(k) != v for k, v in expected.items()):
+                return False
+            conn.execute("UPDATE users SET record = ? WHERE username = ?",
+                         (json.dumps(dict(record, **changes)), username))
+        return True
+
+    # Users are listed by email (or username when there is none), served
+    # from the users_listing expression index.
+    LISTING_RANGE = ("COALESCE(email, lower(username)) >= ? "
+                     "AND COALESCE(email, lower(username)) < ?")
+
+    def _listing_bounds(self, prefix):
+        prefix = prefix.strip().lower()
+        return prefix, prefix + "\U0010ffff"
+
+    def count_users(self, prefix=""):
+        with self.connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM users WHERE {self.LISTING_RANGE}",
+                                self._listing_bounds(prefix)).fetchone()[0]
+
+    def list_users(self, prefix="", offset=0, limit=20):
+        with self.connection() as conn:
+            rows = conn.execute(
+                f"SELECT username, record FROM users WHERE {self.LISTING_RANGE} "
+                "ORDER BY COALESCE(email, lower(username)), username LIMIT ? OFFSET ?",
+                (*self._listing_bounds(prefix), limit, offset)).fetchall()
+        return [(username, json.loads(record)) for username, record in rows]
+
+    def _check_key(self, conn, username, key):
+        # Same transaction as the write, so a key change lands before or after it.
+        if key is None:
+            return
+        row = conn.execute("SELECT record FROM users WHERE username = ?",
+                           (username,)).fetchone()
+        if not row or json.loads(row[0]).get("key") != key:
+            raise KeyRotated(username)
+
+    def add_entry(self, username, title, token, tags=None, terms=(), key=None):
+        return self.add_entries(username, [(title, token, tags, terms)], key)[0]
+
+    def add_entries(self, username, items, key=None):
+        now, ids = time.time(), []
+        with self.transaction() as conn:
+            self._check_key(conn, username, key)
+            for title, token, tags, terms in items:
+                entry_id = conn.execute(
+                    "INSERT INTO entries (username, title, created, token, tags) "
+                    "VALUES (?, ?, ?, ?, ?)", (username, title, now, token, tags)).lastrowid
+                conn.executemany("INSERT OR IGNORE INTO entry_terms VALUES (?, ?, ?)",
+                                 [(username, term, entry_id) for term in terms])
+                ids.append(entry_id)
+        return ids
+
+    def update_tokens(self, username, changes, field="token"):
+        if field not in TOKEN_FIELDS:
+            raise ValueError(f"Not a token field: {field!r}")
+        with self.transaction() as conn:
+            conn.executemany(
+                f"UPDATE entries SET {field} = ? WHERE username = ? AND id = ? AND {field} = ?",
+                [(new, username, entry_id, old) for entry_id, (old, new) in changes.items()])
+
+    def index_entries(self, username, terms):
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR IGNORE INTO entry_terms VALUES (?, ?, ?)",
+                             [(username, term, entry_id)
+                              for entry_id, tokens in terms.items() for term in tokens])
+
+    def find_entries(self, username, terms, limit=50):
+        terms = list(dict.fromkeys(terms))
+        if not terms:
+            return []
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, title, created, version FROM entries WHERE username = ? AND id IN "
+                "(SELECT entry_id FROM entry_terms WHERE username = ? AND term IN "
+                f"({', '.join('?' * len(terms))}) GROUP BY entry_id HAVING COUNT(*) = ?) "
+                "ORDER BY id DESC LIMIT ?",
+                (username, username, *terms, len(terms), limit)).fetchall()
+        return [{"id": row[0], "title": row[1], "created": row[2], "version": row[3]}
+                for row in rows]
+
+    def iter_entries(self, username, after=None, batch=500):
+        # Oldest first, tokens included, fetched in keyset-paged batches.
+        last = -1 if after is None else after
+        while True:
+            with self.connection() as conn:
+                rows = conn.execute(
+                    f"SELECT {self.ENTRY_FIELDS} FROM entries "
+                    "WHERE username = ? AND id > ? ORDER BY id LIMIT ?",
+                    (username, last, batch)).fetchall()
+            for row in rows:
+                yield self._entry(row)
+            if len(rows) < batch:
+                return
+            last = rows[-1][0]
+
+    def count_entries(self, username):
+        with self.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM entries WHERE username = ?",
+                                (username,)).fetchone()[0]
+
+    def list_entries(self, username, offset=0, limit=10):
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, title, created, version FROM entries WHERE username = ? "
+                "ORDER BY id DESC LIMIT ? OFFSET ?", (username, limit, offset)).fetchall()
+        return [{"id": row[0], "title": row[1], "created": row[2], "version": row[3]}
+                for row in rows]
+
+    ENTRY_FIELDS = "id, title, created, token, version, updated, tags"
+
+    def _entry(self, row):
+        return {"id": row[0], "title": row[1], "created": row[2], "token": row[3],
+                "version": row[4], "updated": row[5], "tags": row[6]}
+
+    def get_entry(self, username, entry_id):
+        with self.connection() as conn:
+            row = conn.execute(
+                f"SELECT {self.ENTRY_FIELDS} FROM entries WHERE username = ? AND id = ?",
+                (username, entry_id)).fetchone()
+        return self._entry(row) if row else None
+
+    def get_history(self, username, entry_id):
+        # One read transaction, so the entry and its versions match.
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute(
+                    f"SELECT {self.ENTRY_FIELDS} FROM entries WHERE username = ? AND id = ?",
+                    (username, entry_id)).fetchone()
+                rows = conn.execute(
+                    "SELECT version, created, kind, token FROM entry_versions "
+                    "WHERE entry_id = ? ORDER BY version", (row[0],)).fetchall() if row else []
+            finally:
+                conn.execute("COMMIT")
+        if not row:
+            return None, []
+        return self._entry(row), [{"version": r[0], "created": r[1], "kind": r[2], "token": r[3]}
+                                  for r in rows]
+
+    def add_version(self, username, entry_id, expected, token, item, keep, before=None,
+                    key=None):
+        with self.transaction() as conn:
+            self._check_key(conn, username, key)
+            if not conn.execute(
+                    "UPDATE entries SET token = ?, version = ?, updated = ? "
+                    "WHERE username = ? AND id = ? AND token = ?",
+                    (token, item["version"] + 1, time.time(), username, entry_id,
+                     expected)).rowcount:
+                return False
+            conn.execute("INSERT OR REPLACE INTO entry_versions VALUES (?, ?, ?, ?, ?)",
+                         (entry_id, item["version"], item["created"], item["kind"],
+                          item["token"]))
+            # Timestamps are positive, so a cutoff of 0 drops nothing by age.
+            conn.execute(
+                "DELETE FROM entry_versions WHERE entry_id = ? "
+                "AND (version <= ? OR COALESCE(created, 0) < ?)",
+                (entry_id, item["version"] - keep, before or 0))
+        return True
+
+    def update_version_tokens(self, username, entry_id, changes):
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE entry_versions SET token = ? WHERE entry_id = ? AND version = ? "
+                "AND token = ? AND entry_id IN (SELECT id FROM entries WHERE username = ?)",
+                [(new, entry_id, version, old, username)
+                 for version, (old, new) in changes.items()])
+
+    def prune_versions(self, username, before):
+        with self.connection() as conn:
+            return conn.execute(
+                "DELETE FROM entry_versions WHERE COALESCE(created, 0) < ? "
+                "AND entry_id IN (SELECT id FROM entries WHERE username = ?)",
+                (before, username)).rowcount
+
+    def delete_entry(self, username, entry_id, terms=()):
+        # The entry's terms are found by its id, so terms is not needed here.
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM entry_versions WHERE entry_id IN "
+                         "(SELECT id FROM entries WHERE username = ? AND id = ?)",
+                         (username, entry_id))
+            conn.execute("DELETE FROM entry_terms WHERE entry_id IN "
+                         "(SELECT id FROM entries WHERE username = ? AND id = ?)",
+                         (username, entry_id))
+            conn.execute("DELETE FROM entries WHERE username = ? AND id = ?",
+                         (username, entry_id))
+
+    def delete_entries(self, username):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM entry_versions WHERE entry_id IN "
+                         "(SELECT id FROM entries WHERE username = ?)", (username,))
+            conn.execute("DELETE FROM entry_terms WHERE username = ?", (username,))
+            conn.execute("DELETE FROM entries WHERE username = ?", (username,))
+
+    def clear_index(self, username):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM entry_terms WHERE username = ?", (username,))
+
+
+# ------------------ Selection ------------------
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if BACKEND == "sqlite":
+                _backend = SqliteBackend()
+            elif BACKEND == "json":
+                _backend = JsonBackend()
+            else:
+                raise ValueError(f"Unknown VAULT_BACKEND: {BACKEND!r}")
+        return _backend
+
+
+# ------------------ JSON -> SQLite Import ------------------
+def import_json(db_path=DB_FILE):
+    users = storage.load_file(USERS_FILE)
+    vault = storage.load_file(VAULT_FILE)
+    search = storage.load_file(SEARCH_FILE)
+    history = storage.load_file(HISTORY_FILE)
+    backend = SqliteBackend(db_path, pool_size=1)
+    seen = set()
+    with backend.transaction() as conn:
+        for username, record in users.items():
+            email = record.get("email")
+            email = normalize_email(email) if email else None
+            if email in seen:
+                email = None  # duplicate from before uniqueness was enforced
+            seen.add(email)
+            conn.execute("INSERT OR REPLACE INTO users (username, email, record) VALUES (?, ?, ?)",
+                         (username, email, json.dumps(record)))
+        entries = 0
+        for username, value in vault.items():
+            if isinstance(value, str):
+                value = {"legacy": {"title": LEGACY_TITLE, "created": None, "token": value}}
+            conn.execute("DELETE FROM entry_versions WHERE entry_id IN "
+                         "(SELECT id FROM entries WHERE username = ?)", (username,))
+            conn.execute("DELETE FROM entry_terms WHERE username = ?", (username,))
+            conn.execute("DELETE FROM entries WHERE username = ?", (username,))
+            ids = {}
+            for old_id, e in value.items():
+                entry_id = ids[old_id] = conn.execute(
+                    "INSERT INTO entries (username, title, created, token, version, updated, tags) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (username, e["title"], e["created"], e["token"], e.get("version", 1),
+                     e.get("updated"), e.get("tags"))).lastrowid
+                items = {item["version"]: item for item in e.get("history", [])}
+                items.update((item["version"], item)
+                             for item in history.get(_history_key(username, old_id), {}).values())
+                conn.executemany(
+                    "INSERT INTO entry_versions VALUES (?, ?, ?, ?, ?)",
+                    [(entry_id, item["version"], item["created"], item["kind"], item["token"])
+                     for item in items.values()])
+            # Search postings follow the entries to their new ids.
+            conn.executemany(
+                "INSERT OR IGNORE INTO entry_terms VALUES (?, ?, ?)",
+                [(username, term, ids[old_id])
+                 for term in search.get(_terms_key(username), {})
+                 for old_id in search.get(_posting_key(username, term), {}) if old_id in ids])
+            entries += len(value)
+    return len(users), entries
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["import"]:
+        sys.exit("usage: python backends.py import [DB_FILE]")
+    imported = import_json(*sys.argv[2:3])
+    print("Imported %d users and %d vault entries." % imported)
@@ -0,0 +1,585 @@
+import argparse
+import base64
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import security
+import storage
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# ------------------ Stress: concurrent writers ------------------
+# Every thread in every process registers users and stores vault entries at
+# the same time. Afterwards all of them must be on disk: no lost writes.
+def _stress_worker(worker, count):
+    for i in range(count):
+        name = f"w{worker}-u{i}"
+        storage.add_user(name, {"email": f"{name}@stress.test", "password": "x", "key": "k"})
+        storage.put_record(storage.VAULT_FILE, name, f"token-{i}")
+        storage.update_file(storage.USERS_FILE, lambda users: users.update({f"{name}-alt": {}}))
+
+
+def _stress_process(first, threads, count):
+    workers = [threading.Thread(target=_stress_worker, args=(first + t, count))
+               for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+
+def stress(args):
+    os.chdir(tempfile.mkdtemp(prefix="vault-stress-"))
+    storage.COMPACT_MIN_RECORDS = 32  # force compactions during the run
+    start = time.perf_counter()
+    procs = [multiprocessing.Process(target=_stress_process,
+                                     args=(p * args.threads, args.threads, args.count))
+             for p in range(args.processes)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    storage._cache.clear()
+    users = storage.load_file(storage.USERS_FILE)
+    vault = storage.load_file(storage.VAULT_FILE)
+    expected = args.processes * args.threads * args.count
+    print(f"users: {len(users)}/{2 * expected}  vault: {len(vault)}/{expected}  "
+          f"elapsed: {elapsed:.2f}s")
+    if len(users) != 2 * expected or len(vault) != expected:
+        raise SystemExit("lost writes detected")
+    print("no lost writes")
+
+
+# ------------------ Burst: group commit ------------------
+# Many sessions saving at once in one process, the way a burst of Register
+# and "Encrypt & Save" clicks arrives: each thread registers a user and
+# stores an entry, over and over. Runs once with every save committing on
+# its own and once through the group commit writer.
+def _burst_worker(worker, count, latencies):
+    for i in range(count):
+        name = f"b{worker}-u{i}"
+        started = time.perf_counter()
+        storage.add_user(name, {"email": f"{name}@burst.test", "password": "x", "key": "k"})
+        storage.put_record(storage.VAULT_FILE, name, {"e": {"title": "t", "token": "x"}})
+        latencies.append(time.perf_counter() - started)
+
+
+def burst(args):
+    os.chdir(tempfile.mkdtemp(prefix="vault-burst-"))
+    print(f"{'mode':<14}{'saves/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'batches':>10}"
+          f"{'mean batch':>12}")
+    for mode, enabled in (("per save", False), ("group commit", True)):
+        for name in (storage.USERS_FILE, storage.VAULT_FILE, storage.VAULT_FILE + ".migrated",
+                     storage.VAULT_LOG, storage.VAULT_INDEX):
+            if os.path.exists(name):
+                os.remove(name)
+        storage._cache.clear()
+        storage.GROUP_COMMIT = enabled
+        before = storage.commit_stats()
+        latencies = []
+        workers = [threading.Thread(target=_burst_worker, args=(t, args.count, latencies))
+                   for t in range(args.threads)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        stats = storage.commit_stats()
+        batches = stats["batches"] - before["batches"]
+        saves = stats["saves"] - before["saves"]
+        print(f"{mode:<14}{2 * len(latencies) / elapsed:>10,.0f}"
+              f"{_percentile(latencies, 50) * 1000:>10.2f}{_percentile(latencies, 99) * 1000:>10.2f}"
+              f"{batches:>10}{saves / batches if batches else 0:>12.1f}")
+
+
+# ------------------ Login: password hash cost ------------------
+# Times verify_password at each scrypt cost so VAULT_SCRYPT_N can be chosen
+# from measured p50/p99 login latency rather than guessed.
+def login(args):
+    print(f"{'scheme':<22}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    legacy = hashlib.sha256(b"bench-password").hexdigest()
+    settings = [("sha256 (legacy)", legacy)]
+    for log_n in range(args.min_log_n, args.max_log_n + 1):
+        n = 2 ** log_n
+        settings.append((f"scrypt n=2^{log_n} r={args.r}",
+                         security.hash_password("bench-password", n=n, r=args.r, p=1)))
+    best = None
+    for name, stored in settings:
+        samples = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            security.verify_password("bench-password", stored)
+            samples.append((time.perf_counter() - start) * 1000)
+        p99 = _percentile(samples, 99)
+        print(f"{name:<22}{_percentile(samples, 50):>10.2f}{p99:>10.2f}"
+              f"{statistics.mean(samples):>10.2f}")
+        if stored.startswith("scrypt$") and p99 <= args.target_ms:
+            best = stored.split("$")[1]
+    if best:
+        print(f"\nHighest cost within {args.target_ms} ms p99: VAULT_SCRYPT_N={best}")
+    else:
+        print(f"\nNo scrypt setting met {args.target_ms} ms p99 on this machine.")
+
+
+# ------------------ Unwrap: envelope key cache ------------------
+# Times unwrap_key with the cache cleared before every call (cold) and with
+# every key already cached (warm). --kms-latency-ms adds a delay to each
+# unwrap to stand in for a remote KMS round trip.
+class _SlowKms(security.LocalKms):
+    def __init__(self, master_key, latency):
+        super().__init__(master_key)
+        self.latency = latency
+
+    def unwrap(self, wrapped):
+        time.sleep(self.latency)
+        return super().unwrap(wrapped)
+
+
+def unwrap(args):
+    master = security.Fernet.generate_key().decode()
+    security.set_kms(_SlowKms(master, args.kms_latency_ms / 1000))
+    keys = [security.wrap_key(security.Fernet.generate_key().decode())
+            for _ in range(args.users)]
+    print(f"{'cache':<8}{'p50 us':>10}{'p99 us':>10}{'mean us':>10}")
+    for name, cold in (("cold", True), ("warm", False)):
+        if not cold:
+            for key in keys:
+                security.unwrap_key(key)
+        samples = []
+        for i in range(args.rounds):
+            if cold:
+                security.clear_unwrapped()
+            key = keys[i % len(keys)]
+            start = time.perf_counter()
+            security.unwrap_key(key)
+            samples.append((time.perf_counter() - start) * 1e6)
+        print(f"{name:<8}{_percentile(samples, 50):>10.1f}{_percentile(samples, 99):>10.1f}"
+              f"{statistics.mean(samples):>10.1f}")
+    print(f"\n{security.unwrap_stats()}")
+
+
+# ------------------ Suite: hot paths at production sizes ------------------
+# python bench.py suite --sizes 1000,100000,1000000 --output results.json
+# python bench.py suite --compare results.json
+# Every size gets a fresh directory of synthetic users and vault entries and
+# is measured in its own process, so no cache carries over. All timings go
+# through service.py, the same calls the Streamlit pages make. Results are
+# JSON; with --compare, any operation whose p50 is more than --threshold
+# slower than in the earlier run fails the command.
+SUITE_PASSWORD = "suite-password"
+ROOT = os.path.dirname(os.path.abspath(__file__))
+COLD_START = ("import time; started = time.perf_counter(); import service; "
+              "service.count_users(); service.count_entries('user0000000'); "
+              "print(time.perf_counter() - started)")
+
+
+def _summary(samples):
+    return {"rounds": len(samples), "p50_ms": round(_percentile(samples, 50), 3),
+            "p99_ms": round(_percentile(samples, 99), 3),
+            "mean_ms": round(statistics.mean(samples), 3), "min_ms": round(min(samples), 3)}
+
+
+def _time(fn, rounds):
+    samples = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return _summary(samples)
+
+
+def _generate(users, entries):
+    # Written straight to disk in the storage formats; going through add_user
+    # would rewrite users.json once per user. Every account shares one
+    # password hash and data key, which does not change any code path.
+    from cryptography.fernet import Fernet
+    password = security.hash_password(SUITE_PASSWORD)
+    data_key = Fernet.generate_key().decode()
+    key = security.wrap_key(data_key)
+    token = Fernet(data_key.encode()).encrypt(b"synthetic secret").decode()
+    now = time.time()
+    with open(storage.USERS_FILE, "w") as f:
+        f.write("{")
+        for i in range(users):
+            record = {"email": f"user{i:07d}@suite.test", "password": password, "key": key}
+            f.write(("," if i else "") + f"\n    {json.dumps(f'user{i:07d}')}: {json.dumps(record)}")
+        f.write("\n}")
+    with open(storage.VAULT_LOG, "wb") as f:
+        for i in range(users):
+            f.write(storage._put_line(f"user{i:07d}", {
+                f"{i:07d}{n:04d}": {"title": f"Secret {n}", "created": now, "token": token}
+                for n in range(entries)}))
+    # Leave the vault as a long-running one would be: compacted, with an index.
+    storage.compact(storage.VAULT_FILE)
+
+
+def _suite_size(folder, users, entries, backend, rounds, write_rounds, seed):
+    os.chdir(folder)
+    import backends
+    import service
+    backends.BACKEND = backend
+    results = {"users": users}
+    start = time.perf_counter()
+    _generate(users, entries)
+    if backend == "sqlite":
+        backends.import_json(backends.DB_FILE)
+    results["generate_s"] = round(time.perf_counter() - start, 3)
+
+    env = dict(os.environ, VAULT_BACKEND=backend, PYTHONPATH=ROOT)
+    samples = []
+    for _ in range(3):
+        out = subprocess.run([sys.executable, "-c", COLD_START], env=env, check=True,
+                             capture_output=True, text=True).stdout
+        samples.append(float(out) * 1000)
+    results["cold_start"] = _summary(samples)
+
+    rng = random.Random(seed)
+    picks = [f"user{rng.randrange(users):07d}" for _ in range(max(rounds, 4 * write_rounds))]
+    store = service.get_backend()
+    # Warm the caches and indexes, as the first reruns would.
+    service.count_users()
+    service.count_entries(picks[0])
+    store.find_user_by_email(f"{picks[0]}@suite.test")
+
+    def rerun_vault(i):
+        service.count_entries(picks[i])
+        service.list_entries(picks[i], 0, 10)
+
+    def rerun_users(i):
+        service.count_users()
+        service.list_users("", 0, 20)
+
+    def retrieve(i):
+        entry = service.list_entries(picks[i], 0, 10)[0]
+        service.reveal(picks[i], entry["id"])
+
+    # Logins and deletes each use their own users so throttling and earlier
+    # deletes do not skew them.
+    logins = picks[write_rounds:2 * write_rounds]
+    deletes = picks[2 * write_rounds:3 * write_rounds]
+    results["rerun_vault"] = _time(rerun_vault, rounds)
+    results["rerun_users"] = _time(rerun_users, rounds)
+    results["login_lookup"] = _time(lambda i: store.find_user_by_email(f"{picks[i]}@suite.test"),
+                                    rounds)
+    results["login"] = _time(lambda i: service.login(f"{logins[i]}@suite.test", SUITE_PASSWORD,
+                                                     f"suite-{i}"), write_rounds)
+    results["register"] = _time(lambda i: service.register(f"new{i}", f"new{i}@suite.test",
+                                                           SUITE_PASSWORD, f"suite-{i}"),
+                                write_rounds)
+    results["store"] = _time(lambda i: service.store_text(picks[i], "Suite", "stored secret"),
+                             write_rounds)
+    results["retrieve"] = _time(retrieve, rounds)
+    results["delete"] = _time(lambda i: service.delete_all(deletes[i]), write_rounds)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def suite(args):
+    report = {"meta": {"commit": _git_commit(), "python": platform.python_version(),
+                       "platform": platform.platform(), "backend": args.backend,
+                       "entries_per_user": args.entries, "seed": args.seed,
+                       "started": time.strftime("%Y-%m-%dT%H:%M:%S")},
+              "results": {}}
+    spawn = multiprocessing.get_context("spawn")
+    for users in (int(size) for size in args.sizes.split(",")):
+        folder = tempfile.mkdtemp(prefix=f"vault-suite-{users}-")
+        try:
+            with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+                results = pool.submit(_suite_size, folder, users, args.entries, args.backend,
+                                      args.rounds, args.write_rounds, args.seed).result()
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        report["results"][str(users)] = results
+        print(f"{users:>9} users (generated in {results['generate_s']}s)", file=sys.stderr)
+        for op, summary in results.items():
+            if isinstance(summary, dict):
+                print(f"    {op:<14}{summary['p50_ms']:>10.2f} ms p50{summary['p99_ms']:>10.2f} ms p99",
+                      file=sys.stderr)
+
+    payload = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(payload)
+    else:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            before = json.load(f)["results"]
+        regressions = []
+        for size, results in report["results"].items():
+            for op, summary in results.items():
+                old = before.get(size, {}).get(op)
+                if isinstance(summary, dict) and isinstance(old, dict) and old["p50_ms"] > 0:
+                    ratio = summary["p50_ms"] / old["p50_ms"]
+                    if ratio > 1 + args.threshold:
+                        regressions.append(f"{size} users {op}: {old['p50_ms']} -> "
+                                           f"{summary['p50_ms']} ms p50 ({ratio:.2f}x)")
+        for line in regressions:
+            print(f"regression: {line}", file=sys.stderr)
+        if regressions:
+            raise SystemExit(1)
+
+
+# ------------------ Startup: import cost ------------------
+# Imports each module in a fresh interpreter under -X importtime and reports
+# the import wall time, the heaviest imports by self time, and whether
+# cryptography was loaded at startup (it should wait for the first vault
+# operation). --output writes the numbers as JSON for comparing commits.
+STARTUP_MODULES = "views,service,api,vault_cli"
+STARTUP_CODE = ("import sys, time; started = time.perf_counter(); import {}; "
+                "print(time.perf_counter() - started, 'cryptography' in sys.modules)")
+
+
+def _heaviest(importtime, count):
+    rows = []
+    for line in importtime.splitlines():
+        if line.startswith("import time:") and "|" in line and "[us]" not in line:
+            own, cumulative, name = line[len("import time:"):].split("|")
+            rows.append((int(own), int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def startup(args):
+    report = {}
+    print(f"{'module':<12}{'p50 ms':>10}{'min ms':>10}  cryptography loaded", file=sys.stderr)
+    for module in args.modules.split(","):
+        samples, crypto, proc = [], False, None
+        for _ in range(args.rounds):
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                                   STARTUP_CODE.format(module)],
+                                  cwd=ROOT, capture_output=True, text=True)
+            if proc.returncode:
+                break
+            seconds, loaded = proc.stdout.split()
+            samples.append(float(seconds) * 1000)
+            crypto = loaded == "True"
+        if not samples:
+            error = (proc.stderr.strip().splitlines() or ["import failed"])[-1]
+            print(f"{module:<12}  {error}", file=sys.stderr)
+            report[module] = {"error": error}
+            continue
+        heaviest = _heaviest(proc.stderr, args.top)
+        report[module] = dict(_summary(samples), cryptography_loaded=crypto,
+                              heaviest=[{"module": name, "self_us": own, "cumulative_us": total}
+                                        for own, total, name in heaviest])
+        print(f"{module:<12}{_percentile(samples, 50):>10.1f}{min(samples):>10.1f}  "
+              f"{'yes' if crypto else 'no'}", file=sys.stderr)
+        for own, total, name in heaviest:
+            print(f"    {name:<40}{own / 1000:>8.1f} ms self{total / 1000:>9.1f} ms total",
+                  file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": {"commit": _git_commit(), "python": platform.python_version()},
+                       "results": report}, f, indent=2)
+
+
+# ------------------ Encoding: vault file formats ------------------
+# Encodes one synthetic vault, with real Fernet tokens of mixed lengths, as
+# the original indented vault.json, as JSON-lines log records and as packed
+# binary log records, then decodes each back and checks it matches exactly.
+# Timings are the best of --rounds.
+def _encodings():
+    # The logs are written and read back the way compaction and replay do.
+    def written(vault, binary):
+        f = io.BytesIO()
+        storage._write_records(f, vault, binary)
+        return f.getvalue()
+
+    def replayed(payload, binary):
+        body = payload[storage.LOG_HEADER.size:] if binary else payload
+        return {record["k"]: record["v"] for record in storage._parse(body, binary)[0]}
+
+    return [
+        ("vault.json (indent=4)", lambda vault: json.dumps(vault, indent=4).encode(), json.loads),
+        ("json log", lambda vault: written(vault, False), lambda payload: replayed(payload, False)),
+        ("binary log", lambda vault: written(vault, True), lambda payload: replayed(payload, True)),
+    ]
+
+
+def _best(fn, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def encoding(args):
+    rng = random.Random(args.seed)
+    cipher = security.Fernet(security.new_key())
+    now = time.time()
+    vault = {f"user{i:07d}": {
+        f"{i:07d}{n:04d}": {"title": f"Secret {n}", "created": now + n,
+                            "token": cipher.encrypt(os.urandom(rng.randrange(8, 512))).decode()}
+        for n in range(args.entries)} for i in range(args.users)}
+    count = args.users * args.entries
+    print(f"{'format':<24}{'MB':>8}{'size':>8}{'encode ms':>11}{'decode ms':>11}"
+          f"{'decode MB/s':>13}  lossless")
+    baseline = None
+    for name, encode, decode in _encodings():
+        encode_s, payload = _best(lambda: encode(vault), args.rounds)
+        decode_s, decoded = _best(lambda: decode(payload), args.rounds)
+        size = len(payload)
+        baseline = baseline or size
+        print(f"{name:<24}{size / 1e6:>8.2f}{size / baseline:>8.0%}{encode_s * 1000:>11.1f}"
+              f"{decode_s * 1000:>11.1f}{size / 1e6 / decode_s:>13.1f}  "
+              f"{'yes' if decoded == vault else 'NO'}")
+    print(f"\n{args.users} users x {args.entries} entries = {count} tokens")
+
+
+# ------------------ Compression: compress-then-encrypt ------------------
+# Runs security.compress_plaintext on typical secrets, the way store_text
+# does, and reports the stored token size against encrypting as is, plus the
+# CPU time per MB of plaintext to compress and to decompress. Short
+# passwords show the automatic skip.
+def _corpora(size, rng):
+    words = ["error", "warning", "request", "user", "timeout", "cache", "vault", "session",
+             "token", "retry", "latency", "database", "config", "service", "handler"]
+
+    def fill(line):
+        text, i = [], 0
+        while sum(map(len, text)) < size:
+            text.append(line(i))
+            i += 1
+        return "".join(text)[:size]
+
+    return {
+        "json": fill(lambda i: json.dumps({"id": i, "user": f"user{rng.randrange(1000)}",
+                                           "tags": rng.sample(words, 3),
+                                           "score": round(rng.random(), 4)}) + ",\n"),
+        "log": fill(lambda i: f"2026-10-18T12:{i // 60 % 60:02d}:{i % 60:02d}Z "
+                              f"{rng.choice(['INFO', 'WARN', 'ERROR'])} "
+                              f"{' '.join(rng.choices(words, k=6))} id={rng.randrange(10 ** 6)}\n"),
+        "config": fill(lambda i: f"{rng.choice(words)}_{i}.{rng.choice(words)} = "
+                                 f"{rng.choice(['true', 'false', str(rng.randrange(10 ** 4))])}\n"),
+        "base64": base64.b64encode(rng.randbytes(size))[:size].decode(),
+        "password": "correct-horse-battery-9",
+    }
+
+
+def compression(args):
+    rng = random.Random(args.seed)
+    cipher = security.Fernet(security.new_key())
+    print(f"{'secret':<10}{'method':<6}{'plain KB':>10}{'token KB':>10}{'as is KB':>10}"
+          f"{'saved':>8}{'comp ms/MB':>12}{'decomp ms/MB':>14}")
+    for name, text in _corpora(args.size * 1024, rng).items():
+        data = text.encode()
+        plain_token = len(cipher.encrypt(data))
+        mb = len(data) / 1e6
+        for method in args.methods.split(","):
+            compress_s, packed = _best(
+                lambda: security.compress_plaintext(data, method), args.rounds)
+            decompress_s, restored = _best(
+                lambda: security.decompress_plaintext(packed), args.rounds)
+            if restored != data:
+                raise SystemExit(f"{name}/{method}: round trip failed")
+            token = len(cipher.encrypt(packed))
+            if packed is data:
+                saved, compress_ms, decompress_ms = "skipped", "-", "-"
+            else:
+                saved = f"{1 - token / plain_token:.0%}"
+                compress_ms = f"{compress_s * 1000 / mb:.1f}"
+                decompress_ms = f"{decompress_s * 1000 / mb:.1f}"
+            print(f"{name:<10}{method:<6}{len(data) / 1024:>10.1f}{token / 1024:>10.1f}"
+                  f"{plain_token / 1024:>10.1f}{saved:>8}{compress_ms:>12}{decompress_ms:>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Secure Vault benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("stress", help="concurrent writers, checks for lost writes")
+    p.add_argument("--processes", type=int, default=4)
+    p.add_argument("--threads", type=int, default=8)
+    p.add_argument("--count", type=int, default=25)
+    p.set_defaults(run=stress)
+
+    p = commands.add_parser("burst", help="save throughput under bursts, with group commit")
+    p.add_argument("--threads", type=int, default=32)
+    p.add_argument("--count", type=int, default=50)
+    p.set_defaults(run=burst)
+
+    p = commands.add_parser("login", help="login latency per password hash cost")
+    p.add_argument("--rounds", type=int, default=20)
+    p.add_argument("--min-log-n", type=int, default=12)
+    p.add_argument("--max-log-n", type=int, default=17)
+    p.add_argument("--r", type=int, default=8)
+    p.add_argument("--target-ms", type=float, default=100.0)
+    p.set_defaults(run=login)
+
+    p = commands.add_parser("unwrap", help="data key unwrap cost, cache cold vs warm")
+    p.add_argument("--rounds", type=int, default=2000)
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--kms-latency-ms", type=float, default=0.0)
+    p.set_defaults(run=unwrap)
+
+    p = commands.add_parser("suite", help="hot paths at production data sizes, as JSON")
+    p.add_argument("--sizes", default="1000,100000,1000000", help="comma-separated user counts")
+    p.add_argument("--entries", type=int, default=1, help="vault entries per user")
+    p.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    p.add_argument("--rounds", type=int, default=50)
+    p.add_argument("--write-rounds", type=int, default=10)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--output", default="-")
+    p.add_argument("--compare", help="earlier results to check for regressions")
+    p.add_argument("--threshold", type=float, default=0.25,
+                   help="allowed p50 slowdown before --compare fails (0.25 = 25%%)")
+    p.set_defaults(run=suite)
+
+    p = commands.add_parser("startup", help="import time of the app's modules")
+    p.add_argument("--modules", default=STARTUP_MODULES)
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--top", type=int, default=5, help="heaviest imports to list")
+    p.add_argument("--output", help="also write the results as JSON")
+    p.set_defaults(run=startup)
+
+    p = commands.add_parser("encoding", help="vault size and speed, JSON vs packed binary")
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--entries", type=int, default=20, help="vault entries per user")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(run=encoding)
+
+    p = commands.add_parser("compression", help="compress-then-encrypt: bytes saved, CPU per MB")
+    p.add_argument("--size", type=int, default=256, help="KB per sample secret")
+    p.add_argument("--methods", default="zlib,lzma")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(run=compression)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
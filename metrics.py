@@ -0,0 +1,203 @@
+import heapq
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+# ------------------ Metrics ------------------
+# Process-wide latency histograms and counters for vault operations. Every
+# timed operation is one series of vault_operation_seconds{op="..."}, and the
+# cache statistics from storage and security are exported as gauges. render()
+# produces the Prometheus text format served at GET /metrics by api.py; the
+# admin Diagnostics page reads snapshot().
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {}  # op -> {"buckets": [...], "count": n, "sum": seconds}
+_errors = Counter()  # op -> calls that raised
+_counters = Counter()  # event name -> count
+_gauges = {}  # prefix -> function returning a dict of numbers
+
+
+def observe(op, seconds):
+    with _lock:
+        histogram = _histograms.get(op)
+        if histogram is None:
+            histogram = _histograms[op] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+        index = bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram["buckets"][index] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+@contextmanager
+def timer(op):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        with _lock:
+            _errors[op] += 1
+        raise
+    finally:
+        observe(op, time.perf_counter() - start)
+
+
+def timed(op):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(op):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def register_gauges(prefix, collect):
+    _gauges[prefix] = collect
+
+
+def quantile(histogram, q):
+    # Upper bound of the bucket holding the q-th observation.
+    rank, seen = q * histogram["count"], 0
+    for bound, count in zip(BUCKETS, histogram["buckets"]):
+        seen += count
+        if seen >= rank:
+            return bound
+    return float("inf")
+
+
+def snapshot():
+    with _lock:
+        operations = {op: dict(histogram, buckets=list(histogram["buckets"]), errors=_errors[op])
+                      for op, histogram in _histograms.items()}
+        counters = dict(_counters)
+    gauges = {prefix: collect() for prefix, collect in list(_gauges.items())}
+    return {"operations": operations, "counters": counters, "gauges": gauges}
+
+
+def render():
+    data = snapshot()
+    lines = ["# HELP vault_operation_seconds Latency of vault operations.",
+             "# TYPE vault_operation_seconds histogram"]
+    for op, histogram in sorted(data["operations"].items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram["buckets"]):
+            cumulative += count
+            lines.append(f'vault_operation_seconds_bucket{{op="{op}",le="{bound}"}} {cumulative}')
+        lines.append(f'vault_operation_seconds_bucket{{op="{op}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'vault_operation_seconds_sum{{op="{op}"}} {histogram["sum"]:.6f}')
+        lines.append(f'vault_operation_seconds_count{{op="{op}"}} {histogram["count"]}')
+    lines += ["# HELP vault_operation_errors_total Vault operations that raised.",
+              "# TYPE vault_operation_errors_total counter"]
+    for op, histogram in sorted(data["operations"].items()):
+        lines.append(f'vault_operation_errors_total{{op="{op}"}} {histogram["errors"]}')
+    for name, count in sorted(data["counters"].items()):
+        lines += [f"# TYPE vault_{name}_total counter", f"vault_{name}_total {count}"]
+    for prefix, values in sorted(data["gauges"].items()):
+        for name, value in sorted(values.items()):
+            if isinstance(value, (int, float)):
+                lines += [f"# TYPE vault_{prefix}_{name} gauge", f"vault_{prefix}_{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+# ------------------ Rerun Profiler ------------------
+# Opt in with VAULT_PROFILE=1. This is a sampling profiler: one background
+# thread records the stack of every rerun in flight each PROFILE_INTERVAL
+# seconds, so concurrent sessions can be profiled at once and a rerun that
+# Streamlit cuts short costs nothing. The PROFILE_KEEP slowest reruns are kept
+# and dumped to PROFILE_DIR as collapsed stacks ("a;b;c <samples>" lines),
+# which flamegraph.pl and speedscope read directly.
+PROFILE_ENABLED = os.environ.get("VAULT_PROFILE") == "1"
+PROFILE_DIR = os.environ.get("VAULT_PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = 0.005
+PROFILE_KEEP = 10
+PROFILE_STALE_SECONDS = 5 * 60
+
+_profile_lock = threading.Lock()
+_active = {}  # thread id -> (started, Counter of collapsed stacks)
+_slowest = []  # min-heap of (seconds, sequence, label, stacks, path)
+_sequence = 0
+_sampler = None
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def _sample():
+    while True:
+        time.sleep(PROFILE_INTERVAL)
+        frames = sys._current_frames()
+        now = time.perf_counter()
+        with _profile_lock:
+            for ident, (started, stacks) in list(_active.items()):
+                frame = frames.get(ident)
+                if frame is None or now - started > PROFILE_STALE_SECONDS:
+                    del _active[ident]  # thread gone or rerun abandoned
+                else:
+                    stacks[_collapse(frame)] += 1
+
+
+def start_rerun():
+    global _sampler
+    started = time.perf_counter()
+    if PROFILE_ENABLED:
+        with _profile_lock:
+            if _sampler is None:
+                _sampler = threading.Thread(target=_sample, name="vault-profiler", daemon=True)
+                _sampler.start()
+            # Replaces any earlier rerun on this thread that never finished.
+            _active[threading.get_ident()] = (started, Counter())
+    return started
+
+
+def _keep(label, seconds, stacks):
+    global _sequence
+    if len(_slowest) >= PROFILE_KEEP and seconds <= _slowest[0][0]:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"rerun-{int(time.time() * 1000)}-{seconds * 1000:.0f}ms.txt")
+    with open(path, "w") as f:
+        f.write(f"# {label}: {seconds * 1000:.1f} ms\n")
+        for stack, samples in stacks.most_common():
+            f.write(f"{stack} {samples}\n")
+    _sequence += 1
+    heapq.heappush(_slowest, (seconds, _sequence, label, stacks, path))
+    if len(_slowest) > PROFILE_KEEP:
+        dropped = heapq.heappop(_slowest)
+        if os.path.exists(dropped[4]):
+            os.remove(dropped[4])
+
+
+def finish_rerun(started, label=""):
+    seconds = time.perf_counter() - started
+    observe("rerun", seconds)
+    if PROFILE_ENABLED:
+        with _profile_lock:
+            profile = _active.pop(threading.get_ident(), None)
+            if profile is not None and profile[0] == started:
+                _keep(label, seconds, profile[1])
+    return seconds
+
+
+def slowest_reruns():
+    with _profile_lock:
+        ranked = sorted(_slowest, reverse=True)
+    return [{"label": label, "seconds": seconds, "path": path, "stacks": stacks.most_common(10)}
+            for seconds, _, label, stacks, path in ranked]
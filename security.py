@@ -0,0 +1,512 @@
+import base64
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import metrics
+
+# ------------------ Lazy Imports ------------------
+# cryptography is a large share of startup time ("python bench.py startup"),
+# so it is imported on the first vault operation instead of at launch.
+# Fernet, MultiFernet and InvalidToken stay reachable as security.<name>.
+def _fernet():
+    from cryptography import fernet
+    return fernet
+
+
+def __getattr__(name):
+    if name in ("Fernet", "InvalidToken", "MultiFernet"):
+        return getattr(_fernet(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def new_key():
+    return _fernet().Fernet.generate_key().decode()
+
+
+# ------------------ Password Hashing ------------------
+# Stored as "scrypt$<n>$<r>$<p>$<salt>$<hash>" (base64). The cost is set with
+# VAULT_SCRYPT_N/R/P; run "python bench.py login" to pick values from measured
+# login latency. Bare SHA-256 hex digests from older accounts still verify and
+# are flagged for an upgrade, as are hashes made with other cost settings.
+SCRYPT_N = int(os.environ.get("VAULT_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("VAULT_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("VAULT_SCRYPT_P", "1"))
+SALT_BYTES = 16
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode()
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + (1 << 20), dklen=32)
+
+
+@metrics.timed("hash_password")
+def hash_password(password, n=None, r=None, p=None):
+    n, r, p = n or SCRYPT_N, r or SCRYPT_R, p or SCRYPT_P
+    salt = os.urandom(SALT_BYTES)
+    return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+@metrics.timed("verify_password")
+def verify_password(password, stored):
+    # Returns (matches, needs_rehash).
+    if not stored.startswith("scrypt$"):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), True
+    _, n, r, p, salt, expected = stored.split("$")
+    n, r, p = int(n), int(r), int(p)
+    actual = _scrypt(password, base64.b64decode(salt), n, r, p)
+    matches = hmac.compare_digest(actual, base64.b64decode(expected))
+    return matches, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+# ------------------ Hashing Pool ------------------
+# scrypt releases the GIL, so slow hashes run on a small shared pool instead of
+# each session's script thread. At most HASH_WORKERS run at once and
+# HASH_QUEUE_LIMIT more may wait; past that callers get HashingBusy straight
+# away, so a login storm is turned back instead of stalling every rerun.
+HASH_WORKERS = int(os.environ.get("VAULT_HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_QUEUE_LIMIT = int(os.environ.get("VAULT_HASH_QUEUE", str(4 * HASH_WORKERS)))
+HASH_TIMEOUT = float(os.environ.get("VAULT_HASH_TIMEOUT", "10"))
+
+
+class HashingBusy(Exception):
+    pass
+
+
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="vault-hash")
+_hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_LIMIT)
+
+
+def run_hashing(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise HashingBusy("The server is busy right now. Please try again in a moment.")
+    try:
+        future = _hash_pool.submit(fn, *args)
+    except BaseException:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        raise HashingBusy("The server is busy right now. Please try again in a moment.")
+
+
+# ------------------ Attempt Throttling ------------------
+# Sliding-window limits per client IP and per email, checked before any
+# hashing work is queued. Only the THROTTLE_KEYS most recent keys are kept.
+ATTEMPT_LIMITS = {
+    "ip": (int(os.environ.get("VAULT_ATTEMPTS_PER_IP", "30")), 60),
+    "email": (int(os.environ.get("VAULT_ATTEMPTS_PER_EMAIL", "10")), 60),
+}
+THROTTLE_KEYS = 10000
+
+_attempts = OrderedDict()  # (kind, value) -> deque of attempt times
+_throttle_lock = threading.Lock()
+
+
+def allow_attempt(kind, value):
+    # No value (a client whose address is unknown) means no limit, rather
+    # than one bucket every such client shares and can lock the others out of.
+    if value is None:
+        return True
+    limit, window = ATTEMPT_LIMITS[kind]
+    now = time.monotonic()
+    with _throttle_lock:
+        times = _attempts.pop((kind, value), None) or deque()
+        while times and now - times[0] >= window:
+            times.popleft()
+        allowed = len(times) < limit
+        if allowed:
+            times.append(now)
+        _attempts[(kind, value)] = times
+        while len(_attempts) > THROTTLE_KEYS:
+            _attempts.popitem(last=False)
+        return allowed
+
+
+# ------------------ Key Wrapping ------------------
+# Per-user data keys are stored wrapped ("wrapped:<token>") under a master key,
+# so reading users.json is no longer enough to decrypt the vault. The master
+# key comes from VAULT_MASTER_KEY or the keyfile at VAULT_MASTER_KEY_FILE,
+# which is created on first use. LocalKms stands in for a real KMS; anything
+# with wrap/unwrap methods can take its place through set_kms. Unwrapped keys
+# are cached for at most UNWRAP_TTL seconds, UNWRAP_CACHE_SIZE at a time, so
+# building a cipher does not pay a KMS round trip on every miss.
+MASTER_KEY_FILE = os.environ.get("VAULT_MASTER_KEY_FILE", "master.key")
+WRAPPED_PREFIX = "wrapped:"
+UNWRAP_CACHE_SIZE = 1024
+UNWRAP_TTL = 5 * 60
+
+_kms = None
+_kms_lock = threading.Lock()
+_unwrapped = OrderedDict()  # wrapped key -> (data key, expires)
+_unwrap_lock = threading.Lock()
+_unwrap_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+class LocalKms:
+    def __init__(self, master_keys):
+        # Comma-separated master keys: the first wraps, any of them unwraps,
+        # so the master key itself can be rotated.
+        fernet = _fernet()
+        self._fernet = fernet.MultiFernet([fernet.Fernet(k.strip().encode())
+                                           for k in master_keys.split(",")])
+
+    def wrap(self, key):
+        return self._fernet.encrypt(key.encode()).decode()
+
+    def unwrap(self, wrapped):
+        return self._fernet.decrypt(wrapped.encode()).decode()
+
+
+def load_secret(env_name, path):
+    # A secret from the environment, else from a keyfile created on first use
+    # holding 32 random bytes in urlsafe base64 (also a valid Fernet key).
+    if os.environ.get(env_name):
+        return os.environ[env_name]
+    if not os.path.exists(path):
+        # Write a complete keyfile aside and link it into place; if another
+        # process got there first, the link fails and its secret is used.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(base64.urlsafe_b64encode(os.urandom(32)).decode())
+                f.flush()
+                os.fsync(f.fileno())
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+    with open(path) as f:
+        return f.read().strip()
+
+
+def get_kms():
+    global _kms
+    with _kms_lock:
+        if _kms is None:
+            _kms = LocalKms(load_secret("VAULT_MASTER_KEY", MASTER_KEY_FILE))
+        return _kms
+
+
+def set_kms(kms):
+    global _kms
+    with _kms_lock:
+        _kms = kms
+    clear_unwrapped()
+
+
+def is_wrapped(key):
+    return key.startswith(WRAPPED_PREFIX)
+
+
+def wrap_key(key):
+    return WRAPPED_PREFIX + get_kms().wrap(key)
+
+
+@metrics.timed("unwrap_key")
+def unwrap_key(key):
+    # Keys saved before envelope encryption are still plain; they pass
+    # through unchanged until they are wrapped.
+    if not is_wrapped(key):
+        return key
+    now = time.monotonic()
+    with _unwrap_lock:
+        cached = _unwrapped.get(key)
+        if cached is not None and cached[1] > now:
+            _unwrap_stats["hits"] += 1
+            _unwrapped.move_to_end(key)
+            return cached[0]
+        _unwrap_stats["misses"] += 1
+    data_key = get_kms().unwrap(key[len(WRAPPED_PREFIX):])
+    with _unwrap_lock:
+        _unwrapped[key] = (data_key, now + UNWRAP_TTL)
+        _unwrapped.move_to_end(key)
+        while _unwrapped:
+            oldest, (_, expires) = next(iter(_unwrapped.items()))
+            if expires > now and len(_unwrapped) <= UNWRAP_CACHE_SIZE:
+                break
+            del _unwrapped[oldest]
+            _unwrap_stats["evictions"] += 1
+    return data_key
+
+
+def clear_unwrapped():
+    with _unwrap_lock:
+        _unwrapped.clear()
+
+
+def unwrap_stats():
+    with _unwrap_lock:
+        lookups = _unwrap_stats["hits"] + _unwrap_stats["misses"]
+        hit_rate = _unwrap_stats["hits"] / lookups if lookups else 0.0
+        return dict(_unwrap_stats, size=len(_unwrapped), hit_rate=hit_rate)
+
+
+metrics.register_gauges("unwrap_cache", unwrap_stats)
+
+
+# ------------------ Cipher Cache ------------------
+# Building a Fernet decodes and splits the key, which every My Vault rerun
+# used to repeat. Ciphers are cached per user, bounded in size, and dropped
+# after CIPHER_IDLE_SECONDS without use so a key does not outlive its session.
+CIPHER_CACHE_SIZE = 256
+CIPHER_IDLE_SECONDS = 15 * 60
+
+_ciphers = OrderedDict()  # username -> (keys, cipher, last_used)
+_cipher_lock = threading.Lock()
+_cipher_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _expire_ciphers(now):
+    while _ciphers:
+        username, (_, _, last_used) = next(iter(_ciphers.items()))
+        if now - last_used < CIPHER_IDLE_SECONDS and len(_ciphers) <= CIPHER_CACHE_SIZE:
+            break
+        del _ciphers[username]
+        _cipher_stats["evictions"] += 1
+
+
+def _build_cipher(key, old_keys):
+    # While a rotation is running, old keys stay readable: MultiFernet
+    # encrypts with the first (current) key and decrypts with any of them.
+    fernet = _fernet()
+    if not old_keys:
+        return fernet.Fernet(unwrap_key(key).encode())
+    return fernet.MultiFernet([fernet.Fernet(unwrap_key(k).encode()) for k in (key, *old_keys)])
+
+
+@metrics.timed("get_cipher")
+def get_cipher(key, username=None, old_keys=()):
+    if username is None:
+        return _build_cipher(key, old_keys)
+    now = time.monotonic()
+    keys = (key, *old_keys)
+    with _cipher_lock:
+        cached = _ciphers.get(username)
+        # Different keys mean a rotation happened: rebuild rather than reuse.
+        if cached is not None and cached[0] == keys:
+            _cipher_stats["hits"] += 1
+            cipher = cached[1]
+        else:
+            _cipher_stats["misses"] += 1
+            cipher = _build_cipher(key, old_keys)
+        _ciphers[username] = (keys, cipher, now)
+        _ciphers.move_to_end(username)
+        _expire_ciphers(now)
+        return cipher
+
+
+def forget_cipher(username):
+    with _cipher_lock:
+        if _ciphers.pop(username, None) is not None:
+            _cipher_stats["evictions"] += 1
+
+
+def cipher_stats():
+    with _cipher_lock:
+        _expire_ciphers(time.monotonic())
+        lookups = _cipher_stats["hits"] + _cipher_stats["misses"]
+        hit_rate = _cipher_stats["hits"] / lookups if lookups else 0.0
+        return dict(_cipher_stats, size=len(_ciphers), hit_rate=hit_rate)
+
+
+metrics.register_gauges("cipher_cache", cipher_stats)
+
+
+# ------------------ Blind Index ------------------
+# Keyword search without keeping keywords: each word is stored as an HMAC of
+# it under the user's index key, cut to BLIND_TOKEN_BYTES. Equal words give
+# equal tokens, so a lookup matches them, but without the key a token says
+# nothing about its word. The index key is random, not derived from the data
+# key, and kept wrapped in the user record; a key rotation replaces it too
+# and rebuilds the index, so an old data key says nothing about the index.
+BLIND_TOKEN_BYTES = 16
+_WORD = re.compile(r"\w+")
+
+
+def search_words(*texts):
+    return sorted({word for text in texts for word in _WORD.findall(text.casefold())})
+
+
+def new_index_key():
+    # A fresh random index key, wrapped.
+    return wrap_key(base64.urlsafe_b64encode(secrets.token_bytes(32)).decode())
+
+
+def blind_tokens(index_key, words):
+    key = unwrap_key(index_key).encode()
+    return [base64.urlsafe_b64encode(
+                hmac.new(key, word.encode(), hashlib.sha256).digest()[:BLIND_TOKEN_BYTES]
+            ).rstrip(b"=").decode() for word in words]
+
+
+# ------------------ Compression ------------------
+# Text secrets may be compressed before they are encrypted. A compressed
+# plaintext starts with 0xFF, which never begins UTF-8 text, then one byte
+# naming the method; any other plaintext is the text itself, so entries
+# stored before compression read exactly as they did. VAULT_COMPRESSION picks
+# the method for new entries: "none" (the default), "zlib" or "lzma".
+# Secrets under COMPRESS_MIN_BYTES, and those that do not shrink by at least
+# COMPRESS_MIN_SAVING, are stored as is. Compression is opt-in because it lets
+# the ciphertext length depend on the content, which leaks secrets mixed with
+# text an attacker chooses and then observes the size of.
+COMPRESSION = os.environ.get("VAULT_COMPRESSION", "none")
+COMPRESS_MIN_BYTES = 256
+COMPRESS_MIN_SAVING = 0.1
+COMPRESSED = b"\xff"
+_METHODS = {b"z": "zlib", b"x": "lzma"}
+
+
+def compress_plaintext(data, method=None):
+    # data is UTF-8 text; returns what to encrypt.
+    method = method or COMPRESSION
+    if method == "none" or len(data) < COMPRESS_MIN_BYTES:
+        return data
+    with metrics.timer("compress"):
+        if method == "zlib":
+            packed = COMPRESSED + b"z" + zlib.compress(data)
+        elif method == "lzma":
+            import lzma
+            packed = COMPRESSED + b"x" + lzma.compress(data)
+        else:
+            raise ValueError(f"Unknown compression method: {method!r}")
+    if len(packed) > len(data) * (1 - COMPRESS_MIN_SAVING):
+        return data
+    metrics.increment("compression_saved_bytes", len(data) - len(packed))
+    return packed
+
+
+def decompress_plaintext(plain):
+    if not plain.startswith(COMPRESSED):
+        return plain
+    method = _METHODS.get(plain[1:2])
+    with metrics.timer("decompress"):
+        if method == "zlib":
+            return zlib.decompress(plain[2:])
+        if method == "lzma":
+            import lzma
+            return lzma.decompress(plain[2:])
+    raise ValueError("Unknown compression method in stored secret.")
+
+
+# ------------------ Chunked Blob Encryption ------------------
+# Uploaded files are encrypted in CHUNK_SIZE pieces into blobs/<user>/<id>.bin
+# and the vault entry only stores "blob:<id>". Each frame is a 4-byte length
+# plus a Fernet token over (chunk index, last-chunk flag, data), so chunks
+# cannot be reordered, dropped or truncated without failing authentication.
+BLOB_DIR = "blobs"
+BLOB_PREFIX = "blob:"
+CHUNK_SIZE = 1 << 20
+_FRAME = struct.Struct(">I")
+_CHUNK_HEADER = struct.Struct(">QB")
+
+
+def _blob_folder(username):
+    return os.path.join(BLOB_DIR, hashlib.sha256(username.encode()).hexdigest()[:32])
+
+
+def _blob_path(username, blob_id):
+    if not blob_id.isalnum():
+        raise ValueError("Invalid blob reference.")
+    return os.path.join(_blob_folder(username), blob_id + ".bin")
+
+
+def is_blob(token):
+    return token.startswith(BLOB_PREFIX)
+
+
+def encrypt_stream(cipher, source, username, chunk_size=CHUNK_SIZE):
+    blob_id = secrets.token_hex(16)
+    path = _blob_path(username, blob_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".part"
+    try:
+        with open(tmp, "wb") as out:
+            index, chunk = 0, source.read(chunk_size)
+            while True:
+                # Read one chunk ahead so the last one can be flagged.
+                following = source.read(chunk_size) if chunk else b""
+                last = 1 if not following else 0
+                with metrics.timer("encrypt_chunk"):
+                    token = cipher.encrypt(_CHUNK_HEADER.pack(index, last) + chunk)
+                out.write(_FRAME.pack(len(token)))
+                out.write(token)
+                if last:
+                    break
+                index, chunk = index + 1, following
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return BLOB_PREFIX + blob_id
+
+
+def decrypt_stream(cipher, reference, username):
+    # Yields plaintext one chunk at a time; raises InvalidToken on tampering.
+    path = _blob_path(username, reference[len(BLOB_PREFIX):])
+    with open(path, "rb") as f:
+        expected = 0
+        while True:
+            size = f.read(_FRAME.size)
+            if len(size) < _FRAME.size:
+                raise _fernet().InvalidToken
+            with metrics.timer("decrypt_chunk"):
+                plain = cipher.decrypt(f.read(_FRAME.unpack(size)[0]))
+            index, last = _CHUNK_HEADER.unpack_from(plain)
+            if index != expected:
+                raise _fernet().InvalidToken
+            yield plain[_CHUNK_HEADER.size:]
+            if last:
+                return
+            expected += 1
+
+
+def rotate_blob(cipher, reference, username):
+    # Re-encrypt every frame under the cipher's current key without ever
+    # holding more than one chunk of plaintext; needs a MultiFernet.
+    path = _blob_path(username, reference[len(BLOB_PREFIX):])
+    tmp = path + ".rotate"
+    try:
+        with open(path, "rb") as src, open(tmp, "wb") as out:
+            while size := src.read(_FRAME.size):
+                token = cipher.rotate(src.read(_FRAME.unpack(size)[0]))
+                out.write(_FRAME.pack(len(token)))
+                out.write(token)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def delete_blob(reference, username):
+    try:
+        os.remove(_blob_path(username, reference[len(BLOB_PREFIX):]))
+    except FileNotFoundError:
+        pass
+
+
+def delete_blobs(username):
+    shutil.rmtree(_blob_folder(username), ignore_errors=True)
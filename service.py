@@ -0,0 +1,579 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from difflib import SequenceMatcher
+from itertools import islice
+
+import metrics
+from backends import KeyRotated, get_backend
+from security import (
+    HashingBusy, allow_attempt, blind_tokens, compress_plaintext, decompress_plaintext,
+    decrypt_stream, delete_blob, delete_blobs, encrypt_stream, forget_cipher, get_cipher,
+    hash_password, is_blob, is_wrapped, new_index_key, new_key, rotate_blob, run_hashing,
+    search_words, verify_password, wrap_key
+)
+from storage import normalize_email
+
+log = logging.getLogger(__name__)
+
+# ------------------ Vault Service ------------------
+# Everything the vault does, with no Streamlit in sight. app.py and api.py are
+# both thin front ends over these functions. Validation problems raise
+# ValueError with a user-facing message; throttling and an overloaded hashing
+# pool raise HashingBusy.
+# Usernames listed in VAULT_ADMINS (comma-separated) get the Diagnostics page.
+ADMINS = {name.strip() for name in os.environ.get("VAULT_ADMINS", "").split(",") if name.strip()}
+
+
+def registration_error(username, email, password):
+    if "@" not in email:
+        return "Please enter a valid email address."
+    if len(password) < 6:
+        return "Password must be at least 6 characters long."
+    store = get_backend()
+    if store.get_user(username):
+        return "Username already exists. Try a new one."
+    if store.find_user_by_email(email):
+        return "Email is already registered. Try logging in."
+    return None
+
+
+def register(username, email, password, ip=None):
+    error = registration_error(username, email, password)
+    if error:
+        raise ValueError(error)
+    if not allow_attempt("ip", ip):
+        raise HashingBusy("Too many attempts. Please wait a minute and try again.")
+    key = wrap_key(new_key())
+    get_backend().add_user(username, {
+        "email": email,
+        "password": run_hashing(hash_password, password),
+        "key": key,
+        "index_key": new_index_key(),
+        "search_indexed": True  # nothing stored yet, so nothing to backfill
+    })
+    metrics.increment("registrations")
+
+
+def login(email, password, ip=None):
+    # Returns the username, or None for bad credentials.
+    if not (allow_attempt("ip", ip) and allow_attempt("email", normalize_email(email))):
+        raise HashingBusy("Too many login attempts. Please wait a minute and try again.")
+    store = get_backend()
+    user = store.find_user_by_email(email)
+    record = store.get_user(user) if user else None
+    if not record:
+        metrics.increment("login_failures")
+        return None
+    matches, needs_rehash = run_hashing(verify_password, password, record["password"])
+    if not matches:
+        metrics.increment("login_failures")
+        return None
+    if needs_rehash:
+        store.update_user(user, {"password": run_hashing(hash_password, password)})
+    metrics.increment("logins")
+    return user
+
+
+def is_admin(username):
+    return username in ADMINS
+
+
+def wrap_user_keys(username, record=None):
+    # Accounts from before envelope encryption hold their keys in clear. The
+    # write only lands if the keys are unchanged, so a rotation that starts
+    # meanwhile is never overwritten. Returns the current record.
+    store = get_backend()
+    record = record or store.get_user(username)
+    old_keys = record.get("old_keys") or []
+    if all(is_wrapped(k) for k in (record["key"], *old_keys)):
+        return record
+    changes = {"key": record["key"] if is_wrapped(record["key"]) else wrap_key(record["key"]),
+               "old_keys": [k if is_wrapped(k) else wrap_key(k) for k in old_keys]}
+    if store.update_user(username, changes,
+                         expected={"key": record["key"], "old_keys": record.get("old_keys")}):
+        return dict(record, **changes)
+    return store.get_user(username)
+
+
+def user_cipher(username):
+    return _keyed_cipher(username)[1]
+
+
+def _keyed_cipher(username):
+    # The user's key as stored, with its cipher; writes pass the key to the
+    # backend so they fail with KeyRotated if a rotation replaced it meanwhile.
+    record = wrap_user_keys(username, get_backend().get_user(username))
+    return record["key"], get_cipher(record["key"], username, record.get("old_keys", ()))
+
+
+def _carry_over(username, used_key):
+    # After KeyRotated: the current key, and a cipher that encrypts with it
+    # and still reads tokens made with used_key, even once the rotation has
+    # finished and dropped it from old_keys.
+    record = wrap_user_keys(username, get_backend().get_user(username))
+    return record["key"], get_cipher(record["key"],
+                                     old_keys=(used_key, *record.get("old_keys", ())))
+
+
+def _rekey(cipher, token):
+    return cipher.rotate(token.encode()).decode() if token else token
+
+
+def _encrypt_text(cipher, text, compression=None):
+    plain = compress_plaintext(text.encode(), compression)
+    with metrics.timer("encrypt"):
+        return cipher.encrypt(plain).decode()
+
+
+def _decrypt_text(cipher, token):
+    with metrics.timer("decrypt"):
+        plain = cipher.decrypt(token.encode())
+    return decompress_plaintext(plain).decode()
+
+
+def _tags(cipher, tags):
+    # Tags are kept encrypted; returns (clean tag list, token or None).
+    tags = list(dict.fromkeys(tag.strip() for tag in tags if tag.strip()))
+    return tags, _encrypt_text(cipher, json.dumps(tags), "none") if tags else None
+
+
+def _entry_tags(cipher, entry):
+    return json.loads(_decrypt_text(cipher, entry["tags"])) if entry.get("tags") else []
+
+
+def store_text(username, title, text, compression=None, tags=()):
+    # compression: None for VAULT_COMPRESSION's method, or "zlib", "lzma" or
+    # "none" for this entry.
+    key, cipher = _keyed_cipher(username)
+    title = title or "Untitled secret"
+    tags, tags_token = _tags(cipher, tags)
+    token = _encrypt_text(cipher, text, compression)
+    while True:
+        try:
+            return _add_entry(username, title, token, tags, tags_token, key), token
+        except KeyRotated:
+            key, cipher = _carry_over(username, key)
+            token, tags_token = _rekey(cipher, token), _rekey(cipher, tags_token)
+
+
+def store_file(username, title, source, tags=()):
+    # The file is encrypted chunk by chunk into a separate blob; the vault
+    # only keeps a reference to it.
+    key, cipher = _keyed_cipher(username)
+    tags, tags_token = _tags(cipher, tags)
+    reference = encrypt_stream(cipher, source, username)
+    while True:
+        try:
+            return _add_entry(username, title, reference, tags, tags_token, key)
+        except KeyRotated:
+            # Rotated during the upload: re-encrypt the blob before adding it.
+            key, cipher = _carry_over(username, key)
+            rotate_blob(cipher, reference, username)
+            tags_token = _rekey(cipher, tags_token)
+
+
+def count_entries(username):
+    return get_backend().count_entries(username)
+
+
+def list_entries(username, offset=0, limit=10):
+    return get_backend().list_entries(username, offset, limit)
+
+
+def reveal(username, entry_id):
+    # Returns None for a missing entry, else its metadata plus either "text"
+    # or "chunks" (a generator of decrypted file chunks). Raises InvalidToken
+    # if the data does not authenticate.
+    entry = get_backend().get_entry(username, entry_id)
+    if not entry:
+        return None
+    token = entry.pop("token")
+    cipher = user_cipher(username)
+    entry["tags"] = _entry_tags(cipher, entry)
+    if is_blob(token):
+        entry["chunks"] = decrypt_stream(cipher, token, username)
+    else:
+        entry["text"] = _decrypt_text(cipher, token)
+    return entry
+
+
+def delete_entry(username, entry_id):
+    # Returns False if there was no such entry.
+    store = get_backend()
+    entry = store.get_entry(username, entry_id)
+    if not entry:
+        return False
+    tags = _entry_tags(user_cipher(username), entry)
+    store.delete_entry(username, entry_id, _terms(store.get_user(username).get("index_key"),
+                                                  entry["title"], tags))
+    if is_blob(entry["token"]):
+        delete_blob(entry["token"], username)
+    return True
+
+
+def delete_all(username):
+    get_backend().delete_entries(username)
+    delete_blobs(username)
+    forget_cipher(username)
+
+
+def count_users(prefix=""):
+    return get_backend().count_users(prefix)
+
+
+def list_users(prefix="", offset=0, limit=20):
+    return get_backend().list_users(prefix, offset, limit)
+
+
+# ------------------ Search ------------------
+# Entries are found by the words of their titles and tags through a blind
+# index (see security.py): each word is kept only as an HMAC token under the
+# user's index key, in an inverted index the backend keeps next to the
+# vault. A search turns its words into tokens the same way and looks them up,
+# so it reads only the matching entries and decrypts nothing. The index is
+# updated as entries are stored and deleted.
+SEARCH_LIMIT = 50
+
+
+def _terms(key, title, tags=()):
+    return blind_tokens(key, search_words(title, *tags)) if key else ()
+
+
+def _add_entry(username, title, token, tags, tags_token, key=None):
+    # Users get an index key when they register, or else on their first
+    # search, which then backfills their index. Entries stored before that
+    # go unindexed. One stored while that search runs is still indexed: it
+    # either sees the new key on the second look below, or was written before
+    # the key, and so before the backfill read the vault.
+    # key: the data key token was encrypted with, checked by the backend.
+    store = get_backend()
+    search_key = store.get_user(username).get("index_key")
+    entry_id = store.add_entry(username, title, token, tags_token,
+                               _terms(search_key, title, tags), key)
+    # A key rotation may also have replaced the index key meanwhile.
+    current = store.get_user(username).get("index_key")
+    if current and current != search_key:
+        store.index_entries(username, {entry_id: _terms(current, title, tags)})
+    return entry_id
+
+
+def index_key(username):
+    store = get_backend()
+    record = store.get_user(username)
+    if not record.get("index_key"):
+        # Made once and kept until the next key rotation; if two requests
+        # race, the first one's key wins.
+        store.update_user(username, {"index_key": new_index_key()},
+                          expected={"index_key": None})
+        record = store.get_user(username)
+    return record["index_key"]
+
+
+def _backfill_index(username):
+    store = get_backend()
+    cipher, search_key = user_cipher(username), index_key(username)
+    entries = store.iter_entries(username)
+    while batch := list(islice(entries, ROTATION_BATCH)):
+        store.index_entries(username, {
+            entry["id"]: _terms(search_key, entry["title"], _entry_tags(cipher, entry))
+            for entry in batch})
+    # Unless a key rotation has replaced the index key meanwhile; it rebuilds
+    # the index itself.
+    store.update_user(username, {"search_indexed": True}, expected={"index_key": search_key})
+
+
+def search(username, query, limit=SEARCH_LIMIT):
+    # Newest first, metadata only, the entries whose titles and tags hold
+    # every word of query.
+    words = search_words(query)
+    if not words:
+        return []
+    store = get_backend()
+    if not store.get_user(username).get("search_indexed"):
+        _backfill_index(username)
+    with metrics.timer("search"):
+        return store.find_entries(username, blind_tokens(index_key(username), words), limit)
+
+
+# ------------------ Version History ------------------
+# update_text saves a new version of a text entry. The entry's token always
+# holds the latest version in full, so reading it costs what it always did.
+# Older versions are kept as reverse deltas: each is an encrypted line diff
+# that rebuilds it from the version after it. Every SNAPSHOT_EVERY-th older
+# version is kept whole instead (as is any version a diff would not shrink),
+# so rebuilding an old version applies at most SNAPSHOT_EVERY - 1 diffs.
+# Each save keeps the newest HISTORY_VERSIONS older versions and drops any
+# older than HISTORY_DAYS (0 for no age limit). Since a version only depends
+# on newer ones, dropping the oldest never breaks the rest. A background
+# sweep applies HISTORY_DAYS to entries nobody edits, one user at a time at
+# no more than HISTORY_SWEEP_RATE users per second.
+HISTORY_VERSIONS = int(os.environ.get("VAULT_HISTORY_VERSIONS", "20"))
+HISTORY_DAYS = float(os.environ.get("VAULT_HISTORY_DAYS", "0"))
+HISTORY_SWEEP_SECONDS = 60 * 60
+HISTORY_SWEEP_RATE = 20
+SNAPSHOT_EVERY = 8
+
+
+def _line_delta(new, old):
+    # Rebuilds old from new: [start, end] copies new's lines, a string is
+    # inserted as it is.
+    new_lines, old_lines = new.splitlines(keepends=True), old.splitlines(keepends=True)
+    delta = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, new_lines, old_lines,
+                                               autojunk=False).get_opcodes():
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j1 < j2:
+            delta.append("".join(old_lines[j1:j2]))
+    return delta
+
+
+def _apply_delta(new, delta):
+    lines = new.splitlines(keepends=True)
+    return "".join(part if isinstance(part, str) else "".join(lines[part[0]:part[1]])
+                   for part in delta)
+
+
+def _history_cutoff():
+    return time.time() - HISTORY_DAYS * 24 * 60 * 60 if HISTORY_DAYS else None
+
+
+def update_text(username, entry_id, text, compression=None):
+    # Saves text as the entry's newest version and returns its number. Raises
+    # ValueError for files, missing entries, and entries changed meanwhile.
+    store = get_backend()
+    entry, history = store.get_history(username, entry_id)
+    if not entry:
+        raise ValueError("This secret no longer exists.")
+    if is_blob(entry["token"]):
+        raise ValueError("Files cannot be edited.")
+    key, cipher = _keyed_cipher(username)
+    old = _decrypt_text(cipher, entry["token"])
+    version = entry.get("version") or 1
+    if text == old:
+        return version
+    deltas = 0
+    for item in reversed(history):
+        if item["kind"] == "snapshot":
+            break
+        deltas += 1
+    kind, payload = "snapshot", old
+    if deltas < SNAPSHOT_EVERY - 1:
+        delta = json.dumps(_line_delta(text, old), separators=(",", ":"))
+        if len(delta) < len(old):
+            kind, payload = "delta", delta
+    item = {"version": version, "created": entry.get("updated") or entry["created"],
+            "kind": kind, "token": _encrypt_text(cipher, payload)}
+    token, expected = _encrypt_text(cipher, text, compression), entry["token"]
+    while True:
+        try:
+            if store.add_version(username, entry_id, expected, token, item,
+                                 HISTORY_VERSIONS, _history_cutoff(), key):
+                return version + 1
+        except KeyRotated:
+            key, cipher = _carry_over(username, key)
+            token, item["token"] = _rekey(cipher, token), _rekey(cipher, item["token"])
+            continue
+        # A rotation re-encrypting the entry changes its token, not its text.
+        current = store.get_entry(username, entry_id)
+        if (not current or (current.get("version") or 1) != version
+                or _decrypt_text(cipher, current["token"]) != old):
+            raise ValueError("This secret was changed meanwhile. Open it again and retry.")
+        expected = current["token"]
+
+
+def entry_versions(username, entry_id):
+    # Newest first: the current version, then the older ones still kept.
+    entry, history = get_backend().get_history(username, entry_id)
+    if not entry:
+        return []
+    current = {"version": entry.get("version") or 1, "kind": "current",
+               "created": entry.get("updated") or entry["created"]}
+    return [current] + [{key: item[key] for key in ("version", "kind", "created")}
+                        for item in reversed(history)]
+
+
+def reveal_version(username, entry_id, version):
+    # The text of one version, or None if there is no such version (any more).
+    entry, history = get_backend().get_history(username, entry_id)
+    if not entry or is_blob(entry["token"]):
+        return None
+    cipher = user_cipher(username)
+    if version == (entry.get("version") or 1):
+        return _decrypt_text(cipher, entry["token"])
+    start = next((i for i, item in enumerate(history) if item["version"] == version), None)
+    if start is None:
+        return None
+    with metrics.timer("reconstruct"):
+        # Walk up to the nearest full copy, then diff back down to version.
+        end = start
+        while end < len(history) and history[end]["kind"] == "delta":
+            end += 1
+        text = _decrypt_text(cipher, history[end]["token"] if end < len(history)
+                             else entry["token"])
+        for item in reversed(history[start:end]):
+            text = _apply_delta(text, json.loads(_decrypt_text(cipher, item["token"])))
+    return text
+
+
+def prune_history(username):
+    # Drops the user's versions older than HISTORY_DAYS; returns how many.
+    cutoff = _history_cutoff()
+    return get_backend().prune_versions(username, cutoff) if cutoff else 0
+
+
+def _sweep_history():
+    store = get_backend()
+    while True:
+        offset = 0
+        while page := store.list_users("", offset, 500):
+            for username, _ in page:
+                try:
+                    prune_history(username)
+                except Exception:
+                    pass  # tried again on the next sweep
+                time.sleep(1 / HISTORY_SWEEP_RATE)
+            offset += len(page)
+        time.sleep(HISTORY_SWEEP_SECONDS)
+
+
+# ------------------ Key Rotation ------------------
+# rotate_key switches a user to a fresh key at once: new writes use it and
+# old tokens stay readable through MultiFernet. The blind index gets a fresh
+# key as well and its old postings are dropped. One background thread then
+# re-encrypts existing entries, older versions included, and indexes them
+# under the new index key, ROTATION_BATCH at a time, at no more than
+# ROTATION_RATE entries per second, so rotating many users does not compete
+# with active sessions. Progress is saved in the user record after every
+# batch, and unfinished rotations resume when the process restarts. Writes
+# name the key they encrypted with and are re-encrypted and retried if it was
+# replaced meanwhile (see backends.KeyRotated), so no token lands on a key
+# the rotation has already swept past and is about to drop.
+ROTATION_RATE = float(os.environ.get("VAULT_ROTATION_RATE", "200"))
+ROTATION_BATCH = 100
+ROTATION_RETRY_MAX = 300  # seconds between retries of a failing rotation
+
+_rotations = queue.Queue()
+_rotation_failures = {}
+_rotation_worker = None
+_history_worker = None
+_rotation_lock = threading.Lock()
+
+
+def rotate_key(username):
+    store = get_backend()
+    record = store.get_user(username)
+    if record.get("rotation"):
+        raise ValueError("A key rotation is already in progress.")
+    # Compare-and-set, so two concurrent rotations cannot both replace the
+    # key and lose the one the other moved into old_keys.
+    if not store.update_user(username, {
+        "key": wrap_key(new_key()),
+        "old_keys": [record["key"], *record.get("old_keys", [])],
+        "rotation": {"done": 0, "total": store.count_entries(username), "cursor": None},
+        # The blind index gets a new key too, and is rebuilt as entries are
+        # re-encrypted; until then searches backfill it (see search).
+        "index_key": new_index_key(),
+        "search_indexed": False,
+    }, expected={"key": record["key"], "rotation": None}):
+        raise ValueError("A key rotation is already in progress.")
+    store.clear_index(username)
+    start_background_jobs()
+    _rotations.put(username)
+
+
+def rotation_progress(username):
+    return (get_backend().get_user(username) or {}).get("rotation")
+
+
+def _rotate_entries(username):
+    from cryptography.fernet import InvalidToken
+    store = get_backend()
+    state = rotation_progress(username)
+    if not state:
+        return
+    cipher, search_key = user_cipher(username), index_key(username)
+    # Resume after the last finished batch. This holds even if that entry has
+    # been deleted since; the backend then starts over, never skipping ahead.
+    entries = store.iter_entries(username, after=state["cursor"])
+    while batch := list(islice(entries, ROTATION_BATCH)):
+        started = time.monotonic()
+        changes, tag_changes, terms = {}, {}, {}
+        for entry in batch:
+            token = entry["token"]
+            try:
+                terms[entry["id"]] = _terms(search_key, entry["title"], _entry_tags(cipher, entry))
+                if entry.get("tags"):
+                    tag_changes[entry["id"]] = (entry["tags"],
+                                                cipher.rotate(entry["tags"].encode()).decode())
+                if is_blob(token):
+                    rotate_blob(cipher, token, username)
+                else:
+                    changes[entry["id"]] = (token, cipher.rotate(token.encode()).decode())
+                    if (entry.get("version") or 1) > 1:
+                        _rotate_versions(store, cipher, username, entry["id"])
+            except (InvalidToken, FileNotFoundError):
+                pass  # corrupt or deleted meanwhile; nothing to carry over
+        store.update_tokens(username, changes)
+        store.update_tokens(username, tag_changes, "tags")
+        store.index_entries(username, terms)
+        state = dict(state, done=state["done"] + len(batch), cursor=batch[-1]["id"])
+        store.update_user(username, {"rotation": state})
+        time.sleep(max(0.0, len(batch) / ROTATION_RATE - (time.monotonic() - started)))
+    # Only reached once every entry has been visited, and so indexed.
+    store.update_user(username, {"old_keys": [], "rotation": None, "search_indexed": True},
+                      expected={"rotation": state})
+    forget_cipher(username)
+
+
+def _rotate_versions(store, cipher, username, entry_id):
+    from cryptography.fernet import InvalidToken
+    changes = {}
+    for item in store.get_history(username, entry_id)[1]:
+        token = item["token"]
+        try:
+            changes[item["version"]] = (token, cipher.rotate(token.encode()).decode())
+        except InvalidToken:
+            pass
+    store.update_version_tokens(username, entry_id, changes)
+
+
+def _run_rotations():
+    store = get_backend()
+    # Pick up rotations left unfinished by a previous process.
+    offset = 0
+    while page := store.list_users("", offset, 500):
+        for username, record in page:
+            if isinstance(record, dict) and record.get("rotation"):
+                _rotations.put(username)
+        offset += len(page)
+    while True:
+        username = _rotations.get()
+        try:
+            _rotate_entries(username)
+            _rotation_failures.pop(username, None)
+        except Exception:
+            # Saved progress stays in place; try again later, backing off.
+            failures = _rotation_failures[username] = _rotation_failures.get(username, 0) + 1
+            delay = min(ROTATION_RETRY_MAX, 2 ** failures)
+            log.exception("Key rotation for %s failed; retrying in %ds", username, delay)
+            retry = threading.Timer(delay, _rotations.put, (username,))
+            retry.daemon = True
+            retry.start()
+
+
+def start_background_jobs():
+    global _rotation_worker, _history_worker
+    with _rotation_lock:
+        if _rotation_worker is None:
+            _rotation_worker = threading.Thread(target=_run_rotations, name="vault-rotation",
+                                                daemon=True)
+            _rotation_worker.start()
+        if _history_worker is None and HISTORY_DAYS:
+            _history_worker = threading.Thread(target=_sweep_history, name="vault-history",
+                                               daemon=True)
+            _history_worker.start()
@@ -0,0 +1,206 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from security import load_secret
+
+# ------------------ Configuration ------------------
+# VAULT_SESSIONS picks the store: "memory" (one process, the default) or
+# "sqlite" (a database file at VAULT_SESSIONS_DB shared by every worker and
+# replica on the host or volume). A session ends SESSION_IDLE_SECONDS after
+# its last use or SESSION_MAX_SECONDS after login, whichever comes first, and
+# at most MAX_SESSIONS are kept; the least recently used go first.
+STORE = os.environ.get("VAULT_SESSIONS", "memory")
+SESSIONS_DB = os.environ.get("VAULT_SESSIONS_DB", "sessions.db")
+SESSION_KEY_FILE = os.environ.get("VAULT_SESSION_KEY_FILE", "session.key")
+SESSION_IDLE_SECONDS = int(os.environ.get("VAULT_SESSION_IDLE", str(30 * 60)))
+SESSION_MAX_SECONDS = int(os.environ.get("VAULT_SESSION_MAX", str(12 * 60 * 60)))
+MAX_SESSIONS = int(os.environ.get("VAULT_MAX_SESSIONS", "10000"))
+# Shared stores only record a session's last use once a minute, so an active
+# session does not cost a database write on every rerun.
+TOUCH_INTERVAL = 60
+
+
+# ------------------ Signed Tokens ------------------
+# A token is "<session id>.<signature>", signed with the secret from
+# VAULT_SESSION_SECRET or the keyfile. Forged or mangled tokens are turned
+# away before the store is consulted.
+_secret = None
+_secret_lock = threading.Lock()
+
+
+def _signature(session_id):
+    global _secret
+    with _secret_lock:
+        if _secret is None:
+            _secret = load_secret("VAULT_SESSION_SECRET", SESSION_KEY_FILE).encode()
+    digest = hmac.new(_secret, session_id.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def _new_token():
+    session_id = secrets.token_urlsafe(24)
+    return session_id, f"{session_id}.{_signature(session_id)}"
+
+
+def _session_id(token):
+    session_id, _, signature = (token or "").partition(".")
+    if session_id and hmac.compare_digest(signature.encode(), _signature(session_id).encode()):
+        return session_id
+    return None
+
+
+def _expired(created, seen, now):
+    return now - seen > SESSION_IDLE_SECONDS or now - created > SESSION_MAX_SECONDS
+
+
+# ------------------ In-Memory Store ------------------
+class MemorySessionStore:
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session id -> [username, created, seen]
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Least recently used first, so idle-expired sessions are at the front.
+        while self._sessions:
+            session_id, (_, created, seen) = next(iter(self._sessions.items()))
+            if not _expired(created, seen, now) and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def create(self, username):
+        session_id, token = _new_token()
+        now = time.time()
+        with self._lock:
+            self._sessions[session_id] = [username, now, now]
+            self._evict(now)
+        return token
+
+    def get(self, token):
+        # Returns the session's username, or None if it is unknown or expired.
+        session_id = _session_id(token)
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if _expired(session[1], session[2], now):
+                del self._sessions[session_id]
+                return None
+            session[2] = now
+            self._sessions.move_to_end(session_id)
+            return session[0]
+
+    def delete(self, token):
+        with self._lock:
+            self._sessions.pop(_session_id(token), None)
+
+    def stats(self):
+        with self._lock:
+            self._evict(time.time())
+            return {"active": len(self._sessions), "limit": self.max_sessions}
+
+
+# ------------------ SQLite Store ------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    created REAL NOT NULL,
+    seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_seen ON sessions (seen);
+"""
+
+
+class SqliteSessionStore:
+    def __init__(self, path=SESSIONS_DB, max_sessions=MAX_SESSIONS):
+        self.path = path
+        self.max_sessions = max_sessions
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def create(self, username):
+        session_id, token = _new_token()
+        now = time.time()
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM sessions WHERE seen < ? OR created < ?",
+                             (now - SESSION_IDLE_SECONDS, now - SESSION_MAX_SECONDS))
+                conn.execute("INSERT INTO sessions VALUES (?, ?, ?, ?)",
+                             (session_id, username, now, now))
+                conn.execute("DELETE FROM sessions WHERE id IN (SELECT id FROM sessions "
+                             "ORDER BY seen DESC LIMIT -1 OFFSET ?)", (self.max_sessions,))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        return token
+
+    def get(self, token):
+        session_id = _session_id(token)
+        if session_id is None:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT username, created, seen FROM sessions WHERE id = ?",
+                                     (session_id,)).fetchone()
+            if row is None:
+                return None
+            username, created, seen = row
+            if _expired(created, seen, now):
+                self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                return None
+            if now - seen > TOUCH_INTERVAL:
+                self._conn.execute("UPDATE sessions SET seen = ? WHERE id = ?", (now, session_id))
+            return username
+
+    def delete(self, token):
+        session_id = _session_id(token)
+        if session_id is not None:
+            with self._lock:
+                self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            active = self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE seen >= ? AND created >= ?",
+                (now - SESSION_IDLE_SECONDS, now - SESSION_MAX_SECONDS)
+            ).fetchone()[0]
+        return {"active": active, "limit": self.max_sessions}
+
+
+# ------------------ Store Selection ------------------
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_sessions():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STORE == "sqlite":
+                _store = SqliteSessionStore()
+            elif STORE == "memory":
+                _store = MemorySessionStore()
+            else:
+                raise ValueError(f"Unknown VAULT_SESSIONS: {STORE!r}")
+        return _store
+
+
+metrics.register_gauges("sessions", lambda: get_sessions().stats())
@@ -0,0 +1,857 @@
+import bisect
+import json
+import os
+import queue
+import secrets
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from itertools import islice
+
+import metrics
+import vault_pack
+from vault_index import MappedIndex, write_index
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# ------------------ File Paths ------------------
+USERS_FILE = "users.json"
+VAULT_FILE = "vault.json"
+VAULT_LOG = "vault.log"
+
+VAULT_INDEX = "vault.idx"
+# The search index (see backends.JsonBackend).
+SEARCH_FILE = "search.json"
+SEARCH_LOG = "search.log"
+SEARCH_INDEX = "search.idx"
+# Older versions of edited entries (see backends.JsonBackend).
+HISTORY_FILE = "history.json"
+HISTORY_LOG = "history.log"
+HISTORY_INDEX = "history.idx"
+
+# Files stored as append-only logs instead of one JSON document, and the
+# memory-mapped index compaction writes for each.
+_LOGS = {VAULT_FILE: VAULT_LOG, SEARCH_FILE: SEARCH_LOG, HISTORY_FILE: HISTORY_LOG}
+_INDEXES = {VAULT_FILE: VAULT_INDEX, SEARCH_FILE: SEARCH_INDEX, HISTORY_FILE: HISTORY_INDEX}
+# Compact once the bytes appended since the last index pass this fraction of
+# the indexed snapshot, which keeps the tail replayed on open short while
+# each compaction is paid for by a proportional amount of writing.
+COMPACT_TAIL_FRACTION = 0.25
+COMPACT_MIN_RECORDS = 256
+# VAULT_LOG_FORMAT picks how rewritten logs are encoded: "binary" (packed
+# records, see vault_pack.py) or "json" (one JSON line per record, the older
+# format). Logs of either kind are read, and compaction converts a log to
+# this format, so switching back and forth loses nothing.
+LOG_FORMAT = os.environ.get("VAULT_LOG_FORMAT", "binary")
+
+# ------------------ Shared Store ------------------
+# Streamlit re-executes app.py on every rerun, but imported modules stay in
+# sys.modules, so this cache is shared by every session in the process.
+_lock = threading.Lock()
+_cache = {}
+_stats = {"hits": 0, "misses": 0}
+
+
+def _signature(filename):
+    try:
+        info = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (info.st_ino, info.st_size, info.st_mtime_ns)
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    with _lock:
+        return dict(_stats, files=len(_cache))
+
+
+metrics.register_gauges("file_cache", cache_stats)
+
+
+# ------------------ Locking ------------------
+# Each file gets a thread lock for sessions in this process plus an advisory
+# lock on "<file>.lock" for other replicas. The OS lock is only taken by the
+# outermost holder, so locked() can be nested by the same thread.
+_thread_locks = {}
+_held = threading.local()
+
+
+def _thread_lock(filename):
+    with _lock:
+        return _thread_locks.setdefault(filename, threading.RLock())
+
+
+def _os_lock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _os_unlock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked(filename):
+    held = _held.__dict__.setdefault("files", {})
+    outermost = False
+    with _thread_lock(filename):
+        if filename in held:
+            held[filename][1] += 1
+        else:
+            f = open(filename + ".lock", "a+")
+            _os_lock(f)
+            held[filename] = [f, 1]
+        try:
+            yield
+        finally:
+            held[filename][1] -= 1
+            if held[filename][1] == 0:
+                f = held.pop(filename)[0]
+                _os_unlock(f)
+                f.close()
+                outermost = True
+    # Appends made under the lock are durable once it is fully released.
+    if outermost and filename in _unsynced():
+        _unsynced().discard(filename)
+        _commit(filename)
+
+
+def _atomic_write(filename, write):
+    # Write a sibling temp file, fsync it and rename it over the original so
+    # readers only ever see the old or the new contents, never a torn file.
+    folder = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=os.path.basename(filename) + ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# ------------------ Group Commit ------------------
+# Saves from every session are made durable by one writer thread, which
+# turns a burst of them into one commit:
+#   users.json  add_user and update_user queue their change; the writer
+#               applies all queued changes to one copy under the file lock
+#               and writes it once: one serialization, one fsync.
+#   logs        appends are still written in order under the file lock, but
+#               their fsync is left to the writer, which syncs each log once
+#               for all appends made before it. Appenders wait for that only
+#               after releasing the lock, so others can append meanwhile.
+# Callers block until the commit holding their save is durable and get its
+# result or exception. Whatever queues while one commit is being written goes
+# into the next, so batches grow with load and a lone save waits for nothing
+# but its own fsync; GROUP_COMMIT_WINDOW_MS makes the writer also wait that
+# long for more. Appended records are visible to readers in this process
+# as soon as they are written, as they already were to other processes,
+# before their fsync completes. VAULT_GROUP_COMMIT=0 commits every save in
+# its caller's thread instead.
+GROUP_COMMIT = os.environ.get("VAULT_GROUP_COMMIT", "1") != "0"
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("VAULT_GROUP_COMMIT_WINDOW_MS", "0"))
+GROUP_COMMIT_MAX = 1024
+
+_commits = queue.Queue()
+_committer = None
+_commit_stats = {"batches": 0, "saves": 0, "last_batch": 0, "largest_batch": 0}
+
+
+class _Pending:
+    def __init__(self, filename, change=None):
+        self.filename, self.change = filename, change
+        self.result = self.error = None
+        self.queued = time.perf_counter()
+        self.done = threading.Event()
+
+
+def _unsynced():
+    return _held.__dict__.setdefault("unsynced", set())
+
+
+def _commit(filename, change=None):
+    # Blocks until the save is durable; returns change's result.
+    global _committer
+    pending = _Pending(filename, change)
+    # A thread holding the file lock would deadlock the writer; it commits itself.
+    if not GROUP_COMMIT or filename in _held.__dict__.get("files", {}):
+        _write_batch(filename, [pending])
+    else:
+        with _lock:
+            if _committer is None:
+                _committer = threading.Thread(target=_commit_loop, name="vault-commit",
+                                              daemon=True)
+                _committer.start()
+        _commits.put(pending)
+        pending.done.wait()
+        metrics.observe("commit_wait", time.perf_counter() - pending.queued)
+    if pending.error is not None:
+        raise pending.error
+    return pending.result
+
+
+def _write_batch(filename, batch):
+    try:
+        if filename in _LOGS:
+            with open(_LOGS[filename], "ab") as f:
+                os.fsync(f.fileno())
+        else:
+            _apply_changes(filename, batch)
+    except Exception as e:
+        for pending in batch:
+            pending.error = e
+
+
+def _commit_loop():
+    while True:
+        batch = [_commits.get()]
+        deadline = time.monotonic() + GROUP_COMMIT_WINDOW_MS / 1000
+        while len(batch) < GROUP_COMMIT_MAX:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(_commits.get(timeout=remaining) if remaining > 0
+                             else _commits.get_nowait())
+            except queue.Empty:
+                break
+        with metrics.timer("group_commit"):
+            for filename in dict.fromkeys(pending.filename for pending in batch):
+                _write_batch(filename, [p for p in batch if p.filename == filename])
+        with _lock:
+            _commit_stats["batches"] += 1
+            _commit_stats["saves"] += len(batch)
+            _commit_stats["last_batch"] = len(batch)
+            _commit_stats["largest_batch"] = max(_commit_stats["largest_batch"], len(batch))
+        for pending in batch:
+            pending.done.set()
+
+
+def commit_stats():
+    with _lock:
+        batches = _commit_stats["batches"]
+        return dict(_commit_stats, queue_depth=_commits.qsize(),
+                    mean_batch=_commit_stats["saves"] / batches if batches else 0.0)
+
+
+metrics.register_gauges("group_commit", commit_stats)
+
+
+# ------------------ JSON Files ------------------
+# Cached dicts are shared between sessions, so they are never changed in
+# place: writers go through update_file, which edits a copy.
+@metrics.timed("load_file")
+def load_file(filename):
+    if filename in _LOGS:
+        with locked(filename):
+            return _materialize(_log_entry(filename))
+    # Stat before reading: if the file changes mid-read the cached signature is
+    # already stale, so the next call reloads instead of trusting old data.
+    sig = _signature(filename)
+    with _thread_lock(filename):
+        entry = _cache.get(filename)
+        if entry is not None and entry["sig"] == sig:
+            _count("hits")
+            return entry["data"]
+        _count("misses")
+        data = {}
+        if sig is not None:
+            with open(filename, "r") as f:
+                data = json.load(f)
+        _cache[filename] = {"sig": sig, "data": data}
+        return data
+
+
+@metrics.timed("save_file")
+def save_file(filename, data):
+    if filename in _LOGS:
+        _rewrite_log(filename, data)
+        return
+    payload = json.dumps(data, indent=4).encode()
+    with locked(filename):
+        _atomic_write(filename, lambda f: f.write(payload))
+        _cache[filename] = {"sig": _signature(filename), "data": data}
+
+
+def update_file(filename, change):
+    # Read-modify-write under the file lock against the latest on-disk state,
+    # so concurrent writers from any session or replica never lose updates.
+    # change(data) edits the copy in place; its return value is passed back.
+    with locked(filename):
+        data = dict(load_file(filename))
+        result = change(data)
+        if filename in _LOGS:
+            _append_diff(filename, data)
+        else:
+            save_file(filename, data)
+        return result
+
+
+# ------------------ User Indexes ------------------
+# Two indexes are kept next to the cached users dict, rebuilt lazily whenever
+# users.json is (re)loaded from disk and carried over by add_user/update_user:
+#   emails:  email -> username, for login and uniqueness checks
+#   listing: sorted (listing key, username) pairs, for paging and prefix search
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def _email_index(entry):
+    index = entry.get("emails")
+    if index is None:
+        index = {}
+        for username, data in entry["data"].items():
+            email = data.get("email") if isinstance(data, dict) else None
+            if email:
+                # Keep the first match so existing duplicates resolve the way
+                # the old linear scan did.
+                index.setdefault(normalize_email(email), username)
+        entry["emails"] = index
+    return index
+
+
+def _listing_key(username, data):
+    # Users are listed by email; older accounts without one by username.
+    email = data.get("email") if isinstance(data, dict) else None
+    return normalize_email(email) if email else username.lower()
+
+
+def _user_listing(entry):
+    listing = entry.get("listing")
+    if listing is None:
+        listing = sorted((_listing_key(u, d), u) for u, d in entry["data"].items())
+        entry["listing"] = listing
+    return listing
+
+
+def _prefix_range(listing, prefix):
+    prefix = prefix.strip().lower()
+    return (bisect.bisect_left(listing, (prefix,)),
+            bisect.bisect_left(listing, (prefix + "\U0010ffff",)))
+
+
+def find_user_by_email(email):
+    with _thread_lock(USERS_FILE):
+        load_file(USERS_FILE)
+        return _email_index(_cache[USERS_FILE]).get(normalize_email(email))
+
+
+def count_users(prefix=""):
+    with _thread_lock(USERS_FILE):
+        load_file(USERS_FILE)
+        listing = _user_listing(_cache[USERS_FILE])
+    low, high = _prefix_range(listing, prefix)
+    return high - low
+
+
+def list_users(prefix="", offset=0, limit=20):
+    # Both the dict and the listing are replaced, never edited, on writes,
+    # so they can be read here without holding the lock.
+    with _thread_lock(USERS_FILE):
+        users = load_file(USERS_FILE)
+        listing = _user_listing(_cache[USERS_FILE])
+    low, high = _prefix_range(listing, prefix)
+    page = listing[low + offset:min(high, low + offset + limit)]
+    return [(username, users[username]) for _, username in page]
+
+
+def _apply_changes(filename, batch):
+    # Group commit for users.json: the batch shares one copy of the users and
+    # their indexes, which each change edits in place (or leaves alone if it
+    # raises), and one write.
+    with locked(filename):
+        users = dict(load_file(filename))
+        entry = _cache[filename]
+        index, listing = dict(_email_index(entry)), list(_user_listing(entry))
+        for pending in batch:
+            try:
+                pending.result = pending.change(users, index, listing)
+            except Exception as e:
+                pending.error = e
+        if any(pending.error is None for pending in batch):
+            save_file(filename, users)
+            _cache[filename].update(emails=index, listing=listing)
+
+
+def add_user(username, record):
+    email = normalize_email(record["email"])
+
+    def change(users, index, listing):
+        if username in users:
+            raise ValueError("Username already exists.")
+        if email in index:
+            raise ValueError("Email is already registered.")
+        users[username] = record
+        index[email] = username
+        bisect.insort(listing, (_listing_key(username, record), username))
+
+    _commit(USERS_FILE, change)
+
+
+def update_user(username, changes, expected=None):
+    # Merge changes into an existing account. Email changes are not
+    # supported here, so both indexes carry over untouched. With expected,
+    # the merge only happens if those fields still hold those values;
+    # returns whether it did.
+    if "email" in changes:
+        raise ValueError("Email cannot be changed with update_user.")
+
+    def change(users, index, listing):
+        if username not in users:
+            raise KeyError(username)
+        if expected and any(users[username].get(k) != v for k, v in expected.items()):
+            return False
+        users[username] = dict(users[username], **changes)
+        return True
+
+    return _commit(USERS_FILE, change)
+
+
+# ------------------ Vault Log ------------------
+# One JSON record per line: {"k": key, "v": value} for a put and
+# {"k": key, "d": 1} for a delete. Records with an "f" field set or delete a
+# single field of a dict value, so one entry in a user's collection can change
+# without rewriting the rest. The log is always complete on its own, so a
+# write costs one appended line instead of re-serializing everything.
+#
+# Reads go through the vault index (see vault_index.py) when there is one that
+# matches the log: only the records appended after it are replayed, into an
+# overlay of changed keys, and get_record looks a key up in the overlay and
+# then the index. Nothing has to hold the whole vault in memory; load_file
+# still builds the full dict for the rare callers that want everything.
+#
+# Every rewritten log starts with a {"g": id} line naming that version of the
+# file. Inode numbers get reused, so the id, not the inode, is what ties a
+# cached replay or an index to the log it came from.
+#
+# Binary logs hold the same records packed: a LOG_HEADER with the id, then
+# one frame per append (or per FRAME_RECORDS records of a rewrite) holding
+# its length, a CRC32 and the records packed as one list. The CRC is what
+# spots a torn last frame, as the missing newline does for JSON lines, and a
+# torn frame is dropped whole, so a multi-record append never half applies.
+# Appends always use the format the log on disk already has.
+LOG_MAGIC = b"VAULTLOG"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct(">8sI16s")
+FRAME = struct.Struct(">II")
+FRAME_RECORDS = 256
+_DELETED = object()
+
+
+def _put(key, value, field=None):
+    record = {"k": key, "v": value}
+    if field is not None:
+        record["f"] = field
+    return record
+
+
+def _delete(key, field=None):
+    record = {"k": key, "d": 1}
+    if field is not None:
+        record["f"] = field
+    return record
+
+
+def _line(record):
+    return (json.dumps(record) + "\n").encode()
+
+
+def _put_line(key, value, field=None):
+    return _line(_put(key, value, field))
+
+
+def _binary_format():
+    if LOG_FORMAT not in ("binary", "json"):
+        raise ValueError(f"Unknown VAULT_LOG_FORMAT: {LOG_FORMAT!r}")
+    return LOG_FORMAT == "binary"
+
+
+def _encode(records, binary):
+    if not binary:
+        return b"".join(_line(record) for record in records)
+    out = bytearray(FRAME.size)
+    vault_pack.pack_into(out, records)
+    with memoryview(out) as view, view[FRAME.size:] as body:
+        FRAME.pack_into(out, 0, len(body), zlib.crc32(body))
+    return out
+
+
+def _parse(buffer, binary):
+    # The complete records at the start of buffer and the bytes they span. A
+    # crash mid-append leaves a torn last frame or line; parsing stops there.
+    records, good = [], 0
+    if binary:
+        with memoryview(buffer) as view:
+            while good + FRAME.size <= len(view):
+                length, crc = FRAME.unpack_from(view, good)
+                start = good + FRAME.size
+                with view[start:start + length] as body:
+                    if len(body) < length or zlib.crc32(body) != crc:
+                        break
+                    records += vault_pack.unpack(body)
+                good = start + length
+        return records, good
+    for line in buffer.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        if "k" in record:
+            records.append(record)
+        good += len(line)
+    return records, good
+
+
+def _write_records(f, data, binary=None):
+    if binary is None:
+        binary = _binary_format()
+    log_id = secrets.token_hex(8)
+    if binary:
+        f.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, log_id.encode()))
+    else:
+        f.write(_line({"g": log_id}))
+    items = iter(data.items())
+    while batch := [_put(key, value) for key, value in islice(items, FRAME_RECORDS)]:
+        f.write(_encode(batch, binary))
+    return log_id
+
+
+def _log_head(path):
+    # The log's id (None for logs from before ids) and whether it is binary.
+    with open(path, "rb") as f:
+        head = f.read(64)
+    if head.startswith(LOG_MAGIC):
+        _, version, log_id = LOG_HEADER.unpack_from(head)
+        if version != LOG_VERSION:
+            raise ValueError(f"{path} has unsupported log version {version}")
+        return log_id.decode(), True
+    if head.startswith(b'{"g": '):
+        return json.loads(head[:head.index(b"\n")])["g"], False
+    return None, False
+
+
+def _lookup(entry, key):
+    value = entry["overlay"].get(key)
+    if value is None:
+        return entry["index"].get(key) if entry["index"] is not None else None
+    return None if value is _DELETED else value
+
+
+def _apply(entry, records):
+    # Changed values are built aside and published together, so a reader
+    # never sees half of a multi-field write. Values already published are
+    # shared with readers and get copied, never edited.
+    staged, owned = {}, set()
+    for record in records:
+        key, field = record["k"], record.get("f")
+        if field is None:
+            staged[key] = _DELETED if record.get("d") else record["v"]
+            owned.discard(key)
+            continue
+        if key not in owned:
+            current = staged[key] if key in staged else _lookup(entry, key)
+            staged[key] = dict(current) if isinstance(current, dict) else {}
+            owned.add(key)
+        if record.get("d"):
+            staged[key].pop(field, None)
+        else:
+            staged[key][field] = record["v"]
+    entry["overlay"].update(staged)
+    entry["data"] = None
+
+
+def _replay(path, entry, offset):
+    if entry["binary"]:
+        offset = max(offset, LOG_HEADER.size)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        records, good = _parse(f.read(), entry["binary"])
+    if offset + good < os.path.getsize(path):
+        # Drop the torn tail so the next append starts on a clean line.
+        with open(path, "r+b") as f:
+            f.truncate(offset + good)
+    _apply(entry, records)
+    entry["records"] += len(records)
+    entry["size"] = offset + good
+
+
+def migrate_to_log(filename):
+    # Only ever runs once per file. A log that goes missing afterwards is an
+    # error, not a reason to rebuild it from a stale or empty JSON copy.
+    path = _LOGS[filename]
+    with locked(filename):
+        if os.path.exists(path):
+            _retire_json(filename)
+            return False
+        if os.path.exists(filename + ".migrated") or os.path.exists(_INDEXES[filename]):
+            raise FileNotFoundError(f"{path} is missing; restore it from a backup "
+                                    f"(it is not rebuilt from {filename}).")
+        data = {}
+        if os.path.exists(filename):
+            with open(filename, "r") as f:
+                data = json.load(f)
+        _atomic_write(path, lambda f: _write_records(f, data))
+        _retire_json(filename)
+        _cache.pop(filename, None)
+        return True
+
+
+def _retire_json(filename):
+    # Call with the file locked, once the log is durable. The log is the only
+    # copy from here on: the JSON is removed, so secrets deleted later do not
+    # linger in it, and a marker records that the migration happened.
+    marker = filename + ".migrated"
+    if not os.path.exists(marker):
+        note = {"log": _LOGS[filename], "migrated": time.time()}
+        _atomic_write(marker, lambda f: f.write(json.dumps(note).encode()))
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def _open_index(filename, log_id, size):
+    # An index only counts if it was written for this very log file.
+    if log_id is None:
+        return None
+    try:
+        index = MappedIndex(_INDEXES[filename])
+    except (FileNotFoundError, ValueError):
+        return None
+    if index.log_id != log_id or index.base_offset > size:
+        return None
+    return index
+
+
+def _log_entry(filename):
+    # Replay may truncate a torn tail, so it must hold the cross-process lock
+    # or it could cut off another replica's in-flight append.
+    path = _LOGS[filename]
+    with locked(filename):
+        if not os.path.exists(path):
+            migrate_to_log(filename)
+        sig = _signature(path)
+        entry = _cache.get(filename)
+        if entry is not None and entry["sig"] == sig:
+            _count("hits")
+            return entry
+        _count("misses")
+        log_id, binary = _log_head(path)
+        if (entry is not None and log_id is not None and entry["log_id"] == log_id
+                and entry["size"] <= sig[1]):
+            # Same file, appended to by another process: replay just the new part.
+            _replay(path, entry, entry["size"])
+        else:
+            index = _open_index(filename, log_id, sig[1])
+            base = index.base_offset if index is not None else 0
+            entry = {"log_id": log_id, "binary": binary, "index": index, "overlay": {},
+                     "data": None, "records": 0, "base": base, "size": 0}
+            _replay(path, entry, base)
+            _cache[filename] = entry
+            if os.path.exists(filename):
+                _retire_json(filename)  # left behind by an older migration
+        entry["sig"] = _signature(path)
+        if _needs_compaction(entry):
+            _start_compaction(filename)
+        return entry
+
+
+def _materialize(entry):
+    # Call with the file locked.
+    if entry["data"] is None:
+        data = dict(entry["index"].items()) if entry["index"] is not None else {}
+        for key, value in entry["overlay"].items():
+            if value is _DELETED:
+                data.pop(key, None)
+            else:
+                data[key] = value
+        entry["data"] = data
+    return entry["data"]
+
+
+def _needs_compaction(entry):
+    tail = entry["size"] - entry["base"]
+    return entry["records"] > COMPACT_MIN_RECORDS and tail > COMPACT_TAIL_FRACTION * entry["base"]
+
+
+def _append(filename, records):
+    path = _LOGS[filename]
+    with locked(filename):
+        entry = _log_entry(filename)
+        payload = _encode(records, entry["binary"])
+        with open(path, "ab") as f:
+            f.write(payload)
+            f.flush()
+            if GROUP_COMMIT:
+                _unsynced().add(filename)
+            else:
+                os.fsync(f.fileno())
+        _apply(entry, records)
+        entry["records"] += len(records)
+        entry["size"] += len(payload)
+        entry["sig"] = _signature(path)
+        if _needs_compaction(entry):
+            _start_compaction(filename)
+
+
+def get_record(filename, key):
+    # One value from a log-backed file, without building the whole dict.
+    return _lookup(_log_entry(filename), key)
+
+
+def put_record(filename, key, value):
+    _append(filename, [_put(key, value)])
+
+
+def delete_record(filename, key):
+    with locked(filename):
+        if get_record(filename, key) is None:
+            return
+        _append(filename, [_delete(key)])
+
+
+def put_fields(filename, key, fields):
+    # All fields land in one append and one fsync.
+    _append(filename, [_put(key, value, field) for field, value in fields.items()])
+
+
+def update_records(filename, changes):
+    # (key, field, value) triples in one append: a field of None stands for
+    # the whole record, a value of None deletes.
+    _append(filename, [_delete(key, field) if value is None else _put(key, value, field)
+                       for key, field, value in changes])
+
+
+def put_field(filename, key, field, value):
+    put_fields(filename, key, {field: value})
+
+
+def delete_field(filename, key, field):
+    with locked(filename):
+        value = get_record(filename, key)
+        if not isinstance(value, dict) or field not in value:
+            return
+        _append(filename, [_delete(key, field)])
+
+
+def _append_diff(filename, new):
+    old = load_file(filename)
+    records = [_delete(key) for key in old if key not in new]
+    records += [_put(key, value) for key, value in new.items()
+                if key not in old or old[key] != value]
+    if records:
+        _append(filename, records)
+
+
+def _rewrite_log(filename, data):
+    # The new log has a new id, so any existing index stops matching it.
+    path = _LOGS[filename]
+    with locked(filename):
+        binary, log_id = _binary_format(), []
+        _atomic_write(path, lambda f: log_id.append(_write_records(f, data, binary)))
+        _retire_json(filename)
+        _cache[filename] = {
+            "sig": _signature(path),
+            "log_id": log_id[0],
+            "binary": binary,
+            "index": None,
+            "overlay": dict(data),
+            "data": data,
+            "records": len(data),
+            "base": 0,
+            "size": os.path.getsize(path),
+        }
+
+
+# ------------------ Background Compaction ------------------
+# Rewrites the log as one put per live key and writes a matching index.
+# The index is renamed into place first: until the log follows, it names a
+# log id that is not on disk yet and is ignored, so a crash between the two
+# steps only costs a full replay.
+_compacting = set()
+
+
+def _start_compaction(filename):
+    with _lock:
+        if filename in _compacting:
+            return
+        _compacting.add(filename)
+    threading.Thread(target=_compact, args=(filename,), daemon=True).start()
+
+
+def compact(filename):
+    # Compact right away in this thread, unless a compaction is already running.
+    with _lock:
+        if filename in _compacting:
+            return False
+        _compacting.add(filename)
+    _compact(filename)
+    return True
+
+
+def _compact(filename):
+    path, index_path = _LOGS[filename], _INDEXES[filename]
+    folder = os.path.dirname(os.path.abspath(path))
+    tmp = tmp_index = None
+    try:
+        with locked(filename):
+            entry = _log_entry(filename)
+            index, overlay = entry["index"], dict(entry["overlay"])
+            log_id, inode, offset = entry["log_id"], entry["sig"][0], entry["size"]
+            old_binary, binary = entry["binary"], _binary_format()
+        # The expensive part runs without the lock; appends keep going.
+        snapshot = _materialize({"index": index, "overlay": overlay, "data": None})
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=os.path.basename(path) + ".")
+        with os.fdopen(fd, "wb") as f:
+            new_id, base_offset = _write_records(f, snapshot, binary), f.tell()
+        fd, tmp_index = tempfile.mkstemp(dir=folder, prefix=os.path.basename(index_path) + ".")
+        with os.fdopen(fd, "wb") as f:
+            write_index(f, snapshot, new_id, base_offset)
+            os.fsync(f.fileno())
+        with locked(filename):
+            info = os.stat(path)
+            if _log_head(path)[0] != log_id or info.st_ino != inode or info.st_size < offset:
+                return  # rewritten by someone else meanwhile
+            # Carry over everything appended since the snapshot, including
+            # records from other replicas.
+            with open(path, "rb") as src:
+                src.seek(offset)
+                tail = src.read()
+            if binary != old_binary:
+                tail = _encode(_parse(tail, old_binary)[0], binary)
+            with open(tmp, "ab") as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_index, index_path)
+            tmp_index = None
+            os.replace(tmp, path)
+            tmp = None
+            # Reopened from the new index on next use, replaying only the tail.
+            _cache.pop(filename, None)
+    finally:
+        for leftover in (tmp, tmp_index):
+            if leftover and os.path.exists(leftover):
+                os.remove(leftover)
+        with _lock:
+            _compacting.discard(filename)
@@ -0,0 +1,194 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from backends import KeyRotated, get_backend
+from security import (
+    blind_tokens, compress_plaintext, decompress_plaintext, get_cipher, is_blob, is_wrapped,
+    search_words, unwrap_key
+)
+from service import index_key, wrap_user_keys
+
+# ------------------ Bulk Import / Export ------------------
+# python vault_cli.py import USERNAME secrets.csv      (columns: title,text)
+# python vault_cli.py import USERNAME secrets.jsonl    ({"title": ..., "text": ...})
+# python vault_cli.py export USERNAME --mode decrypt > plain.jsonl
+# python vault_cli.py wrap-keys                        (wrap any plaintext user keys)
+#
+# Records stream through in batches: each batch is encrypted across a process
+# pool and written with one store call, so memory stays at one batch no
+# matter how large the input is. Throughput goes to stderr.
+BATCH_SIZE = 500
+
+_cipher = None
+_target = None
+
+
+def _init_worker(keys, target_key=None):
+    global _cipher, _target
+    # keys: the current key, then any old keys a running rotation still needs.
+    _cipher = get_cipher(keys[0], old_keys=keys[1:])
+    _target = get_cipher(target_key) if target_key else None
+
+
+def _encrypt(text):
+    return _cipher.encrypt(compress_plaintext(text.encode())).decode()
+
+
+def _decrypt(token):
+    return decompress_plaintext(_cipher.decrypt(token.encode())).decode()
+
+
+def _reencrypt(token):
+    return _target.encrypt(_cipher.decrypt(token.encode())).decode()
+
+
+def _read_records(path, fmt):
+    with (sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")) as f:
+        rows = csv.DictReader(f) if fmt == "csv" else (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            yield row.get("title") or "Untitled secret", row["text"]
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Progress:
+    def __init__(self, label):
+        self.label, self.records, self.size = label, 0, 0
+        self.start = time.perf_counter()
+
+    def add(self, records, size):
+        self.records += records
+        self.size += size
+        elapsed = time.perf_counter() - self.start
+        print(f"\r{self.label}: {self.records} records, {self.records / elapsed:,.0f} rec/s, "
+              f"{self.size / elapsed / 1e6:,.2f} MB/s", end="", file=sys.stderr)
+
+    def done(self):
+        print(file=sys.stderr)
+
+
+def _user_keys(username):
+    # (the key as stored, the unwrapped current and old keys).
+    record = get_backend().get_user(username)
+    if not record or "key" not in record:
+        sys.exit(f"No vault key for user {username!r}.")
+    # Unwrapped once here, so the workers never talk to the KMS.
+    return record["key"], tuple(unwrap_key(key)
+                                for key in (record["key"], *record.get("old_keys", ())))
+
+
+def import_records(args):
+    store = get_backend()
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+    progress = Progress("imported")
+    search_key = index_key(args.username)
+    key, keys = _user_keys(args.username)
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(keys,)) as pool:
+        for batch in _batches(_read_records(args.path, fmt), args.batch):
+            texts = [text for _, text in batch]
+            tokens = pool.map(_encrypt, texts, chunksize=max(1, len(texts) // (4 * args.workers)))
+            try:
+                store.add_entries(args.username, [
+                    (title, token, None, blind_tokens(search_key, search_words(title)))
+                    for (title, _), token in zip(batch, tokens)], key)
+            except KeyRotated:
+                progress.done()
+                sys.exit(f"The key of {args.username!r} was rotated during the import; the "
+                         f"first {progress.records} records are in. Import the rest again.")
+            progress.add(len(batch), sum(len(text) for text in texts))
+    progress.done()
+
+
+def export_records(args):
+    store = get_backend()
+    _, keys = _user_keys(args.username)
+    worker = {"decrypt": _decrypt, "reencrypt": _reencrypt}.get(args.mode)
+    if args.mode == "reencrypt" and not args.to_key:
+        sys.exit("--to-key is required with --mode reencrypt.")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    writer = csv.writer(out) if args.format == "csv" else None
+    if writer:
+        writer.writerow(["title", "created", "text" if args.mode == "decrypt" else "token"])
+    progress, skipped = Progress("exported"), 0
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                             initargs=(keys, args.to_key)) as pool:
+        for batch in _batches(store.iter_entries(args.username), args.batch):
+            if worker:
+                # Blob entries are references to files, not tokens; they are
+                # left out of decrypted or re-encrypted exports.
+                skipped += sum(1 for entry in batch if is_blob(entry["token"]))
+                batch = [entry for entry in batch if not is_blob(entry["token"])]
+                values = pool.map(worker, [entry["token"] for entry in batch], chunksize=16)
+            else:
+                values = [entry["token"] for entry in batch]
+            size = 0
+            for entry, value in zip(batch, values):
+                size += len(value)
+                if writer:
+                    writer.writerow([entry["title"], entry["created"], value])
+                else:
+                    field = "text" if args.mode == "decrypt" else "token"
+                    out.write(json.dumps({"title": entry["title"], "created": entry["created"],
+                                          field: value}) + "\n")
+            progress.add(len(batch), size)
+    progress.done()
+    if skipped:
+        print(f"skipped {skipped} file entries", file=sys.stderr)
+    if out is not sys.stdout:
+        out.close()
+
+
+def wrap_keys(args):
+    store = get_backend()
+    offset, wrapped = 0, 0
+    while page := store.list_users("", offset, 500):
+        for username, record in page:
+            if isinstance(record, dict) and "key" in record and not is_wrapped(record["key"]):
+                wrap_user_keys(username, record)
+                wrapped += 1
+        offset += len(page)
+    print(f"wrapped keys for {wrapped} users", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export for Secure Vault entries")
+    commands = parser.add_subparsers(dest="command", required=True)
+    workers = os.cpu_count() or 2
+
+    p = commands.add_parser("import", help="encrypt records from CSV/JSONL into a user's vault")
+    p.add_argument("username")
+    p.add_argument("path", help="input file, or - for stdin")
+    p.add_argument("--format", choices=["csv", "jsonl"])
+    p.add_argument("--batch", type=int, default=BATCH_SIZE)
+    p.add_argument("--workers", type=int, default=workers)
+    p.set_defaults(run=import_records)
+
+    p = commands.add_parser("export", help="stream a user's entries out as CSV/JSONL")
+    p.add_argument("username")
+    p.add_argument("--mode", choices=["decrypt", "reencrypt", "raw"], default="decrypt")
+    p.add_argument("--to-key", help="Fernet key to re-encrypt with (--mode reencrypt)")
+    p.add_argument("--format", choices=["csv", "jsonl"], default="jsonl")
+    p.add_argument("--output", default="-")
+    p.add_argument("--batch", type=int, default=BATCH_SIZE)
+    p.add_argument("--workers", type=int, default=workers)
+    p.set_defaults(run=export_records)
+
+    p = commands.add_parser("wrap-keys", help="wrap plaintext user keys with the master key")
+    p.set_defaults(run=wrap_keys)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
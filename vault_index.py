@@ -0,0 +1,106 @@
+import json
+import mmap
+import struct
+from functools import lru_cache
+
+import vault_pack
+
+# ------------------ Vault Index File ------------------
+# A read-optimized snapshot of the vault log, written by compaction next to it
+# as vault.idx:
+#
+#   header   magic, version, the id of the log the snapshot was taken from
+#            and the byte offset it corresponds to, key count, and where the
+#            slots start
+#   values   every value packed with vault_pack (JSON text in version 1
+#            files, which are still read), in key order
+#   keys     the UTF-8 keys, in key order
+#   slots    one fixed-size (key offset, key length, value offset, value
+#            length) slot per key, sorted by key
+#
+# MappedIndex opens it with one header read and an mmap, whatever its size,
+# and finds a key by binary search over the slots, decoding only that value.
+# The pages live in the OS page cache, so every worker process shares them.
+MAGIC = b"VAULTIDX"
+VERSION = 2
+HEADER = struct.Struct(">8sII16sQQQ")
+SLOT = struct.Struct(">QIQI")
+VALUE_CACHE_SIZE = 512
+
+
+def write_index(f, data, log_id, base_offset):
+    # f is a seekable binary file; the header is filled in last.
+    keys = sorted(key.encode() for key in data)
+    f.write(bytes(HEADER.size))
+    slots, offset = [], HEADER.size
+    for key in keys:
+        value = vault_pack.pack(data[key.decode()])
+        f.write(value)
+        slots.append([0, 0, offset, len(value)])
+        offset += len(value)
+    for slot, key in zip(slots, keys):
+        f.write(key)
+        slot[0], slot[1] = offset, len(key)
+        offset += len(key)
+    for slot in slots:
+        f.write(SLOT.pack(*slot))
+    f.seek(0)
+    f.write(HEADER.pack(MAGIC, VERSION, 0, log_id.encode(), base_offset, len(keys), offset))
+    f.flush()
+
+
+def _json_value(view):
+    return json.loads(bytes(view))
+
+
+class MappedIndex:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is not a vault index")
+        magic, version, _, log_id, self.base_offset, self.count, self._slots = \
+            HEADER.unpack_from(self._map)
+        self.log_id = log_id.rstrip(b"\0").decode()
+        if (magic != MAGIC or version not in (1, VERSION)
+                or self._slots + self.count * SLOT.size > len(self._map)):
+            raise ValueError(f"{path} is not a vault index")
+        self._view = memoryview(self._map)
+        self._decode = vault_pack.unpack if version == VERSION else _json_value
+        # Decoded values are shared between callers and must not be changed.
+        self.get = lru_cache(VALUE_CACHE_SIZE)(self._get)
+
+    def _slot(self, position):
+        return SLOT.unpack_from(self._map, self._slots + position * SLOT.size)
+
+    def _find(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            slot = self._slot(middle)
+            found = self._map[slot[0]:slot[0] + slot[1]]
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return slot
+        return None
+
+    def _get(self, key):
+        slot = self._find(key.encode())
+        if slot is None:
+            return None
+        return self._decode(self._view[slot[2]:slot[2] + slot[3]])
+
+    def __contains__(self, key):
+        return self._find(key.encode()) is not None
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        for position in range(self.count):
+            key_at, key_length, value_at, value_length = self._slot(position)
+            yield (self._map[key_at:key_at + key_length].decode(),
+                   self._decode(self._view[value_at:value_at + value_length]))
@@ -0,0 +1,94 @@
+import base64
+import binascii
+import json
+import re
+import struct
+from itertools import accumulate
+
+# ------------------ Packed Values ------------------
+# A compact binary encoding for vault values, used by the vault log and index
+# in place of JSON text. A packed value is its compact JSON text with the
+# Fernet tokens cut out and kept as raw bytes:
+#
+#   u32      token count n
+#   n x      (u32 offset in the text the token was cut from, u32 raw length)
+#   tokens   the n raw tokens, back to back
+#   text     the JSON text without them
+#
+# Tokens are the bulk of a vault, and a third of every token is base64.
+# Stored raw they shrink by a quarter, and the JSON parser no longer has to
+# scan them. A token is only cut out if encoding it again gives back the very
+# same string, so unpack(pack(value)) equals json.loads(json.dumps(value))
+# exactly: nothing about the JSON format is lost.
+#
+# Only whole 3-byte groups are cut out; a token's last, padded base64 group
+# stays in the text. Every stored token is then a multiple of 3 bytes long,
+# so unpacking base64-encodes all of them with one call, splices them back
+# into the (pure ASCII) text and parses it once, all in C, staying close to
+# plain JSON speed. Callers pack many small values as one list to share the
+# fixed cost. unpack reads any buffer (bytes, a memoryview, an mmap slice)
+# without copying it first; pack_into appends to a bytearray the caller
+# writes out.
+COUNT = struct.Struct(">I")
+# A JSON string that is a whole token. Only a separator can come before the
+# opening quote of a string, never a backslash, so quoted tokens inside other
+# strings are left alone.
+_TOKEN = re.compile(rb'(?<![^\[{:,])"(gAAAAA[A-Za-z0-9_-]+={0,2})"')
+_URLSAFE = bytes.maketrans(b"+/", b"-_")
+_dumps = json.JSONEncoder(separators=(",", ":")).encode
+_loads = json.JSONDecoder().decode
+
+
+def _token_bytes(token):
+    # The whole 3-byte groups of a token, or None if it is not one.
+    if len(token) % 4:
+        return None
+    raw = base64.urlsafe_b64decode(token)
+    if base64.urlsafe_b64encode(raw) != token:
+        return None
+    return raw[:len(raw) - len(raw) % 3]
+
+
+def pack_into(out, value):
+    text = _dumps(value).encode()
+    slots, raws, kept, at, size = [], [], [], 0, 0
+    for match in _TOKEN.finditer(text):
+        raw = _token_bytes(match.group(1))
+        if not raw:
+            continue
+        start = match.start(1)
+        kept.append(text[at:start])
+        size += start - at
+        slots += (size, len(raw))
+        raws.append(raw)
+        at = start + len(raw) // 3 * 4
+    out += COUNT.pack(len(raws))
+    if raws:
+        out += struct.pack(f">{len(slots)}I", *slots)
+        out += b"".join(raws)
+        out += b"".join(kept)
+    out += text[at:]
+    return out
+
+
+def pack(value):
+    return bytes(pack_into(bytearray(), value))
+
+
+def unpack(buffer):
+    with memoryview(buffer) as view:
+        count, = COUNT.unpack_from(view)
+        if not count:
+            return _loads(str(view[COUNT.size:], "ascii"))
+        slots = struct.unpack_from(f">{2 * count}I", view, COUNT.size)
+        start = COUNT.size + 8 * count
+        text = start + sum(slots[1::2])
+        cuts = [text + offset for offset in slots[0::2]]
+        if text > view.nbytes or cuts[-1] > view.nbytes:
+            raise ValueError("Packed value is truncated")
+        encoded = binascii.b2a_base64(view[start:text], newline=False).translate(_URLSAFE)
+        ends = list(accumulate((length // 3 * 4 for length in slots[1::2]), initial=0))
+        pieces = [None] * (2 * count + 1)
+        pieces[0::2] = [view[a:b] for a, b in zip([text] + cuts, cuts + [None])]
+        pieces[1::2] = [encoded[a:b] for a, b in zip(ends, ends[1:])]
+        return _loads(b"".join(pieces).decode("ascii"))
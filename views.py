@@ -0,0 +1,310 @@
+import json
+import os
+import tempfile
+from datetime import datetime
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+import metrics
+import security
+import service
+import sessions
+from security import HashingBusy
+
+# ------------------ Configurations ------------------
+# One function per sidebar entry; app.py picks which one runs on each rerun.
+ENTRIES_PER_PAGE = 10
+USERS_PER_PAGE = 20
+# Reverse proxies in front of the app that append to X-Forwarded-For. When
+# set, the address the outermost trusted proxy saw is the client, whatever
+# the socket says (that is the proxy); anything left of it is client-supplied.
+TRUSTED_PROXIES = int(os.environ.get("VAULT_TRUSTED_PROXIES", "0"))
+# The signed session token is kept in this cookie, never in the page URL,
+# where history, logs and shared links would pick it up.
+SESSION_COOKIE = "vault_session"
+
+# ------------------ Helpers ------------------
+def client_ip():
+    # None when unknown, which skips the per-IP attempt limit.
+    context = getattr(st, "context", None)
+    if context is None:
+        return None
+    if TRUSTED_PROXIES:
+        hops = [hop.strip() for hop in context.headers.get("X-Forwarded-For", "").split(",")]
+        ip = hops[-TRUSTED_PROXIES] if len(hops) >= TRUSTED_PROXIES else None
+    else:
+        ip = getattr(context, "ip_address", None)
+    return ip or None
+
+def session_token():
+    # This tab's token, else the cookie the browser sent when the page loaded.
+    token = st.session_state.get("session_token")
+    if token is None:
+        token = (getattr(getattr(st, "context", None), "cookies", None) or {}).get(SESSION_COOKIE)
+    return token
+
+def set_session_cookie(token):
+    # Streamlit cannot set cookies, so a zero-height component writes it into
+    # the app page; None clears it. SameSite=Strict keeps it off cross-site
+    # requests, and it is only sent over HTTPS when the app is served so.
+    st.session_state.session_token = token or ""
+    cookie = (f"{SESSION_COOKIE}={token or ''}; Path=/; SameSite=Strict; "
+              f"Max-Age={sessions.SESSION_MAX_SECONDS if token else 0}")
+    components.html(f"""<script>
+        const page = window.parent;
+        page.document.cookie = {json.dumps(cookie)}
+            + (page.location.protocol === "https:" ? "; Secure" : "");
+    </script>""", height=0)
+
+def compress_method(compress):
+    # Ticking the box uses VAULT_COMPRESSION's method, or zlib when that is "none".
+    if not compress:
+        return "none"
+    return security.COMPRESSION if security.COMPRESSION != "none" else "zlib"
+
+def format_time(timestamp):
+    if timestamp is None:
+        return "earlier"
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+# ------------------ Register ------------------
+def register_page():
+    st.subheader("📝 Create a New Account")
+    new_user = st.text_input("👤 Enter Username")
+    new_email = st.text_input("📧 Enter Email")
+    new_pass = st.text_input("🔑 Enter Password", type="password")
+
+    if new_user and new_email and new_pass:
+        error = service.registration_error(new_user, new_email, new_pass)
+        if error:
+            st.error(f"❌ {error}")
+        else:
+            if st.button("🚀 Register"):
+                try:
+                    service.register(new_user, new_email, new_pass, client_ip())
+                    st.success("✅ Account created successfully!")
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                except HashingBusy as e:
+                    st.warning(f"⏳ {e}")
+    elif st.button("🚀 Register"):
+        st.warning("⚠️ All fields are required to register.")
+
+# ------------------ Login ------------------
+def login_page():
+    st.subheader("🔓 Login to Your Vault")
+    email = st.text_input("📧 Enter Email")
+    password = st.text_input("🔑 Enter Password", type="password")
+
+    if email and password:
+        if "@" not in email:
+            st.error("❌ Please enter a valid email address.")
+        else:
+            if st.button("🔐 Login"):
+                try:
+                    user = service.login(email, password, client_ip())
+                    if user:
+                        # A fresh token on every login; any earlier one ends here.
+                        if old := session_token():
+                            sessions.get_sessions().delete(old)
+                        st.session_state.username = user
+                        set_session_cookie(sessions.get_sessions().create(user))
+                        st.success(f"🚀 Good to see you, {user}! Ready to vault your secrets?")
+                        st.balloons()
+                    else:
+                        st.error("❌ Invalid email or password.")
+                except HashingBusy as e:
+                    st.warning(f"⏳ {e}")
+    elif st.button("🔐 Login"):
+        st.warning("⚠️ Please enter both email and password.")
+
+# ------------------ My Vault ------------------
+def text_history(entry):
+    # Older versions of an unlocked text, and saving an edit as a new one.
+    username = st.session_state.username
+    versions = service.entry_versions(username, entry["id"])
+    if len(versions) > 1:
+        labels = {f"v{v['version']} · 🕒 {format_time(v['created'])}": v["version"]
+                  for v in versions}
+        picked = labels[st.selectbox("🕘 Version history", list(labels),
+                                     key=f"versions-{entry['id']}")]
+        if picked != versions[0]["version"]:
+            text = service.reveal_version(username, entry["id"], picked)
+            if text is None:
+                st.info("ℹ️ This version is no longer kept.")
+            else:
+                st.code(text)
+    edited = st.text_area("✏️ Edit this secret:", entry["text"], key=f"edit-{entry['id']}")
+    if st.button("💾 Save as new version", key=f"save-{entry['id']}"):
+        try:
+            version = service.update_text(username, entry["id"], edited)
+            st.success(f"💾 Saved as version {version}! Earlier versions stay in the history.")
+        except ValueError as e:
+            st.warning(f"⚠️ {e}")
+
+def entry_row(entry):
+    label = f"🔐 **{entry['title']}** · 🕒 {format_time(entry['created'])}"
+    if entry.get("version", 1) > 1:
+        label += f" · ✏️ v{entry['version']}"
+    st.markdown(label)
+    decrypt, delete = st.columns(2)
+    clicked = decrypt.button("🔓 Decrypt", key=f"decrypt-{entry['id']}")
+    if delete.button("🗑️ Delete", key=f"delete-{entry['id']}"):
+        service.delete_entry(st.session_state.username, entry["id"])
+        st.success("🗑️ Secret deleted.")
+        return
+    # An unlocked text stays open across reruns, so its edit and history
+    # controls keep working.
+    if clicked or st.session_state.get("open_entry") == entry["id"]:
+        try:
+            entry = service.reveal(st.session_state.username, entry["id"])
+            if not entry:
+                st.info("ℹ️ This secret no longer exists.")
+                return
+            if entry["tags"]:
+                st.caption("🔖 " + ", ".join(entry["tags"]))
+            if "chunks" in entry and clicked:
+                # Decrypt to a temp file one chunk at a time. st.download_button
+                # still reads the whole file into memory, so downloads here
+                # grow with file size; GET /entries/<id> in api.py streams them.
+                with tempfile.TemporaryFile() as download:
+                    for chunk in entry["chunks"]:
+                        download.write(chunk)
+                    download.seek(0)
+                    st.success("🔓 Your file is unlocked and ready:")
+                    st.download_button("⬇️ Download", download, file_name=entry["title"],
+                                       key=f"download-{entry['id']}")
+            elif "text" in entry:
+                st.session_state.open_entry = entry["id"]
+                st.success("🔓 Here's your unlocked secret message:")
+                st.code(entry["text"])
+                text_history(entry)
+        except (security.InvalidToken, FileNotFoundError):
+            st.error("❌ Unable to decrypt. Data might be corrupted.")
+
+def vault_page():
+    if st.session_state.username:
+        st.subheader(f"🧳 Vault for {st.session_state.username}")
+        tab1, tab2 = st.tabs(["📥 Store Data", "🔍 Retrieve Data"])
+
+        with tab1:
+            title = st.text_input("🏷️ Give your secret a title:")
+            tags = st.text_input("🔖 Tags, comma-separated (optional):").split(",")
+            mode = st.radio("📦 What do you want to store?", ["✍️ Text", "📁 File"], horizontal=True)
+            if mode.startswith("✍️"):
+                data = st.text_area("🗝️ Enter your secret data:")
+                compress = st.checkbox("🗜️ Compress before encrypting", value=False,
+                                       help="Large configs, logs and JSON take less space. "
+                                            "Skipped automatically when it does not help. "
+                                            "Leave off if the secret includes text others choose.")
+                if st.button("💾 Encrypt & Save"):
+                    if data:
+                        _, encrypted = service.store_text(st.session_state.username, title, data,
+                                                          compress_method(compress), tags)
+                        st.success("🔒 Your data has been securely locked away!")
+                        st.code(encrypted, language="text")
+                    else:
+                        st.warning("⚠️ Please enter some data to encrypt.")
+            else:
+                upload = st.file_uploader("📁 Choose a file to encrypt")
+                if st.button("💾 Encrypt & Save"):
+                    if upload:
+                        service.store_file(st.session_state.username, title or upload.name,
+                                           upload, tags)
+                        st.success("🔒 Your file has been securely locked away!")
+                    else:
+                        st.warning("⚠️ Please choose a file to encrypt.")
+
+        with tab2:
+            # Only titles and dates are listed; an entry is decrypted when its
+            # button is pressed, and only one page is fetched per rerun.
+            # Searches go through the blind index and decrypt nothing.
+            query = st.text_input("🔎 Search titles and tags:")
+            if query:
+                entries = service.search(st.session_state.username, query)
+                if not entries:
+                    st.info("ℹ️ No secrets match your search.")
+                for entry in entries:
+                    entry_row(entry)
+            elif total := service.count_entries(st.session_state.username):
+                pages = (total - 1) // ENTRIES_PER_PAGE + 1
+                page = st.number_input(f"📄 Page (1-{pages}, {total} secrets)",
+                                       min_value=1, max_value=pages, value=1)
+                entries = service.list_entries(st.session_state.username,
+                                               (page - 1) * ENTRIES_PER_PAGE, ENTRIES_PER_PAGE)
+                for entry in entries:
+                    entry_row(entry)
+            else:
+                st.info("ℹ️ No data found for this user.")
+    else:
+        st.warning("🔐 Please login first to access your vault.")
+
+    st.markdown("---")
+    st.subheader("⚙️ Account Options")
+
+    if st.session_state.username:
+        progress = service.rotation_progress(st.session_state.username)
+        if progress:
+            done = min(progress["done"], progress["total"])
+            st.progress(done / max(progress["total"], 1),
+                        text=f"🔄 Re-encrypting your vault with a new key: {done}/{progress['total']}")
+        elif st.button("🔄 Rotate My Encryption Key", use_container_width=True):
+            try:
+                service.rotate_key(st.session_state.username)
+                st.success("🔄 New key in use! "
+                           "Your existing secrets are being re-encrypted in the background.")
+            except ValueError as e:
+                st.warning(f"⚠️ {e}")
+
+    logout_label = f"🚪 Log out {st.session_state.username} & 🗑️ Delete My Data"
+    if st.button(logout_label, use_container_width=True):
+        username = st.session_state.username
+        if username:
+            service.delete_all(username)
+        if token := session_token():
+            sessions.get_sessions().delete(token)
+        set_session_cookie(None)
+        st.session_state.username = None
+        st.success("👋 You've been logged out. Your vault has been cleared!")
+        st.balloons()
+
+# ------------------ All Users ------------------
+def users_page():
+    st.subheader("👥 Registered Users")
+    prefix = st.text_input("🔎 Search by email (or username)")
+    total = service.count_users(prefix)
+    if total:
+        pages = (total - 1) // USERS_PER_PAGE + 1
+        page = st.number_input(f"📄 Page (1-{pages}, {total} users)",
+                               min_value=1, max_value=pages, value=1)
+        for username, data in service.list_users(prefix, (page - 1) * USERS_PER_PAGE, USERS_PER_PAGE):
+            email = data.get('email', 'No email provided')
+            st.markdown(f"✅ **{email}**")
+    elif prefix:
+        st.info("🔎 No users match your search.")
+    else:
+        st.info("🚫 No users registered yet.")
+
+# ------------------ Diagnostics ------------------
+def diagnostics_page():
+    st.subheader("📊 Diagnostics")
+    snapshot = metrics.snapshot()
+    st.markdown("#### ⏱️ Operation Latency")
+    st.table([{"operation": op, "calls": h["count"], "errors": h["errors"],
+               "mean ms": round(h["sum"] / h["count"] * 1000, 3),
+               "p50 ms ≤": metrics.quantile(h, 0.5) * 1000,
+               "p99 ms ≤": metrics.quantile(h, 0.99) * 1000}
+              for op, h in sorted(snapshot["operations"].items()) if h["count"]])
+    st.markdown("#### 🔢 Counters")
+    st.json(snapshot["counters"])
+    st.markdown("#### 🗃️ Caches")
+    st.json(snapshot["gauges"])
+    st.markdown("#### 🐢 Slowest Reruns")
+    if not metrics.PROFILE_ENABLED:
+        st.info("Start the app with VAULT_PROFILE=1 to profile reruns.")
+    for rerun in metrics.slowest_reruns():
+        with st.expander(f"{rerun['label'] or 'rerun'}: {rerun['seconds'] * 1000:.0f} ms"):
+            st.caption(f"💾 {rerun['path']}")
+            st.code("\n".join(f"{samples:>5}  ...;{';'.join(stack.split(';')[-4:])}"
+                              for stack, samples in rerun["stacks"]))